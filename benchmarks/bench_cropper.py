@@ -0,0 +1,80 @@
+# Times the cropper on generated card images for a growing number of jobs,
+#   python benchmarks/bench_cropper.py [--cards N] [--dpi DPI] [--jobs 1 2 4 ...]
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pyvips
+
+import image
+from preview_cache import PreviewCache
+
+
+def make_cards(image_dir, cards, dpi):
+    width, height = int(2.72 * dpi), int(3.7 * dpi)
+    for i in range(cards):
+        noise = pyvips.Image.gaussnoise(width // 16, height // 16, mean=128, sigma=60)
+        card = noise.bandjoin([noise.rot180(), noise.flip("horizontal")])
+        card = card.resize(16, kernel="linear").cast("uchar")
+        ext = ".jpg" if i % 3 else ".png"
+        card.write_to_file(os.path.join(image_dir, f"card{i:03d}{ext}"))
+
+
+def run_cropper(source_dir, work_dir, jobs, bleed_edge, vibrance_bump):
+    image_dir = os.path.join(work_dir, "images")
+    shutil.rmtree(image_dir, ignore_errors=True)
+    shutil.copytree(source_dir, image_dir)
+    crop_dir = os.path.join(image_dir, "crop")
+    os.makedirs(crop_dir)
+
+    img_dict = PreviewCache()
+    img_dict.open(os.path.join(work_dir, f"img_{jobs}.cache"))
+
+    start = time.perf_counter()
+    image.cropper(
+        image_dir,
+        crop_dir,
+        img_dict,
+        bleed_edge,
+        1200,
+        vibrance_bump,
+        True,
+        lambda *args: None,
+        jobs,
+    )
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--cards", type=int, default=24)
+    parser.add_argument("--dpi", type=int, default=800)
+    parser.add_argument("--bleed-edge", type=float, default=1.0)
+    parser.add_argument("--vibrance-bump", action="store_true")
+    cpu_count = os.cpu_count() or 1
+    default_jobs = [j for j in (1, 2, 4, 8) if j < cpu_count] + [cpu_count]
+    parser.add_argument("--jobs", type=int, nargs="+", default=default_jobs)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        source_dir = os.path.join(work_dir, "source")
+        os.makedirs(source_dir)
+        make_cards(source_dir, args.cards, args.dpi)
+
+        print(f"{args.cards} cards at {args.dpi} DPI, {cpu_count} CPUs")
+        baseline = None
+        for jobs in args.jobs:
+            elapsed = run_cropper(
+                source_dir, work_dir, jobs, args.bleed_edge, args.vibrance_bump
+            )
+            baseline = baseline or elapsed
+            print(f"jobs={jobs}: {elapsed:.2f}s, {baseline / elapsed:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
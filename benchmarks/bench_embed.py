@@ -0,0 +1,65 @@
+# Times embedding a converted card image into a pdf page through pdf.image_to_samples
+# and pdf.get_insert_args against the PNG round trip they replaced,
+#   python benchmarks/bench_embed.py [--dpi DPI] [--repeat N]
+import io
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pyvips
+import pymupdf
+
+import pdf
+from image import image_to_bytes
+
+
+def png_insert_args(img):
+    return {"pixmap": pymupdf.Pixmap(io.BytesIO(image_to_bytes(img)))}
+
+
+def samples_insert_args(img):
+    return pdf.get_insert_args(pdf.image_to_samples(img))
+
+
+def make_card(dpi, bands):
+    width, height = int(2.48 * dpi), int(3.46 * dpi)
+    noise = pyvips.Image.gaussnoise(width, height, mean=128, sigma=80).gaussblur(2)
+    card = noise.bandjoin([noise.rot180(), noise.flip("horizontal")])
+    if bands == 4:
+        card = card.bandjoin(noise.flip("vertical"))
+    return card.cast("uchar").copy(interpretation="srgb").copy_memory()
+
+
+def best_time(get_insert_args, img, repeat):
+    times = []
+    for _ in range(repeat):
+        document = pymupdf.open()
+        page = document.new_page()
+        start = time.perf_counter()
+        page.insert_image(page.rect, **get_insert_args(img))
+        times.append(time.perf_counter() - start)
+        document.close()
+    return min(times)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dpi", type=int, default=1200)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    for bands in (3, 4):
+        card = make_card(args.dpi, bands)
+        old = best_time(png_insert_args, card, args.repeat)
+        new = best_time(samples_insert_args, card, args.repeat)
+        print(
+            f"{card.width}x{card.height} {'RGBA' if bands == 4 else 'RGB'}: "
+            f"png {old:.3f}s, samples {new:.3f}s, {old / new:.2f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+# Times rendering an N page pdf with cut guides off, on and extended, cards are
+# small so that the time is spent on pages and guides rather than images,
+#   python benchmarks/bench_guides.py [--pages N] [--oversized] [--repeat N]
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pyvips
+
+import pdf
+from constants import page_sizes
+
+
+def make_print_dict(pages, oversized):
+    # Letter portrait fits 3x3 cards, every eighth card is oversized with --oversized
+    cards = {f"card{i:03d}.png": 9 for i in range(pages)}
+    return {
+        "cards": cards,
+        "backside_enabled": False,
+        "backside_default": "__back.png",
+        "backside_offset": "0",
+        "backsides": {},
+        "backside_short_edge": {},
+        "oversized_enabled": oversized,
+        "oversized": {card: True for card in list(cards)[::8]},
+        "pagesize": "Letter",
+        "enable_guides": True,
+        "extended_guides": True,
+        "guide_color_a": 0xBFBFBF,
+        "guide_color_b": 0x000000,
+        "orient": "Portrait",
+        "bleed_edge": "0",
+        "output_profile": "Archive",
+        "optimize_packing": False,
+        "filename": "_printme",
+    }
+
+
+def make_cards(img_dir, names):
+    os.makedirs(img_dir, exist_ok=True)
+    for i, name in enumerate(names):
+        card = pyvips.Image.gaussnoise(64, 88, mean=40 + i % 8 * 20, sigma=30)
+        card = card.bandjoin([card.rot180(), card.flip("horizontal")]).cast("uchar")
+        card.write_to_file(os.path.join(img_dir, name))
+
+
+def render(print_dict, crop_dir, pdf_path):
+    start = time.perf_counter()
+    pdf.generate(
+        print_dict,
+        crop_dir,
+        page_sizes[print_dict["pagesize"]],
+        pdf_path,
+        lambda *args: None,
+    )
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pages", type=int, default=100)
+    parser.add_argument("--oversized", action="store_true")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print_dict = make_print_dict(args.pages, args.oversized)
+    with tempfile.TemporaryDirectory() as work_dir:
+        crop_dir = os.path.join(work_dir, "images", "crop")
+        img_dir = pdf.crop_output_dir(crop_dir, 0.0, pdf.CFG.VibranceBump)
+        make_cards(img_dir, print_dict["cards"])
+
+        for label, enable_guides, extended_guides in [
+            ("no guides", False, False),
+            ("guides", True, False),
+            ("extended guides", True, True),
+        ]:
+            guides_dict = dict(
+                print_dict,
+                enable_guides=enable_guides,
+                extended_guides=extended_guides,
+            )
+
+            # A new file each time, an existing pdf would be re-rendered incrementally
+            times = []
+            for i in range(args.repeat):
+                pdf_path = os.path.join(work_dir, f"{label}_{i}.pdf")
+                times.append(render(guides_dict, crop_dir, pdf_path))
+            size = os.path.getsize(pdf_path) / 1024 / 1024
+            print(f"{label}: {min(times):.2f}s, {size:.2f}MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+# Times distribute_cards_first_fit against the per-copy packer it replaced for
+# growing numbers of copies,
+#   python benchmarks/bench_packing.py [--copies N ...] [--columns C] [--rows R]
+import os
+import sys
+import time
+import argparse
+
+from copy import deepcopy
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pdf
+
+
+# The packer `distribute_cards_first_fit` replaced, placing every copy on its own
+def distribute_cards_per_copy(print_dict, columns, rows):
+    images_per_page = columns * rows
+    oversized_images_per_page = (columns // 2) * rows
+
+    short_edge_dict = print_dict["backside_short_edge"]
+    oversized_dict = print_dict["oversized"] if print_dict["oversized_enabled"] else {}
+
+    # throw all images n times into a list
+    images = []
+    for img, num in print_dict["cards"].items():
+        is_short_edge = short_edge_dict[img] if img in short_edge_dict else False
+        is_oversized = oversized_dict[img] if img in oversized_dict else False
+        images.extend([(img, is_short_edge, is_oversized)] * num)
+
+    # favor filling up with oversized cards first
+    images = sorted(images, key=lambda x: not x[1])
+
+    def page_has_space(page, oversized):
+        oversized_cards = len(page["oversized"])
+        regular_cards = len(page["regular"])
+        single_spaces = regular_cards + oversized_cards * 2
+        free_single_spaces = images_per_page - single_spaces
+        if oversized:
+            free_double_spaces = oversized_images_per_page - oversized_cards
+            return free_double_spaces > 0 and free_single_spaces > 1
+        else:
+            return free_single_spaces > 0
+
+    def is_page_full(page):
+        return page_has_space(page, False) == False
+
+    empty_page = {"regular": [], "oversized": []}
+    pages = []
+
+    unfinished_pages = []
+    for img, is_short_edge, is_oversized in images:
+        # get a page that can fit this card
+        page_with_space = next(
+            filter(lambda x: page_has_space(x, is_oversized), unfinished_pages),
+            None,
+        )
+
+        # or start a new page if none is available
+        if page_with_space is None:
+            unfinished_pages.append(deepcopy(empty_page))
+            page_with_space = unfinished_pages[-1]
+
+        # add the image to the page
+        page_with_space["oversized" if is_oversized else "regular"].append(
+            (img, is_short_edge)
+        )
+
+        # push full page into final list
+        if is_page_full(page_with_space):
+            pages.append(page_with_space)
+            unfinished_pages.remove(page_with_space)
+
+    # push all unfinished pages into final list
+    pages.extend(unfinished_pages)
+    return pages
+
+
+def make_print_dict(copies, card_count=50):
+    cards = {f"card{i}.png": copies // card_count for i in range(card_count)}
+    return {
+        "cards": cards,
+        "backside_short_edge": {card: True for card in list(cards)[::7]},
+        "oversized_enabled": True,
+        "oversized": {card: True for card in list(cards)[::3]},
+        "optimize_packing": False,
+    }
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return (time.perf_counter() - start, result)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--copies", type=int, nargs="+", default=[100, 10_000, 100_000])
+    parser.add_argument("--columns", type=int, default=3)
+    parser.add_argument("--rows", type=int, default=3)
+    args = parser.parse_args()
+
+    for copies in args.copies:
+        print_dict = make_print_dict(copies)
+        layout = (print_dict, args.columns, args.rows)
+        (old, old_pages) = timed(distribute_cards_per_copy, *layout)
+        (new, new_pages) = timed(pdf.distribute_cards_first_fit, *layout)
+        assert new_pages == old_pages
+        print(
+            f"{copies} copies on {len(new_pages)} pages: "
+            f"per copy {old:.4f}s, first fit {new:.4f}s, {old / new:.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
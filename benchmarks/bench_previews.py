@@ -0,0 +1,129 @@
+# Times project startup and print preview refreshes against the preview cache for a
+# large library, next to the json cache that was fully loaded at startup before,
+#   python benchmarks/bench_previews.py [--cards N] [--refreshes N] [--bleed]
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pyvips
+
+import image
+from preview_cache import PreviewCache
+
+
+def make_previews(count):
+    # A few distinct cards, repeated under different names
+    previews = []
+    for i in range(count):
+        noise = pyvips.Image.gaussnoise(744, 1038, mean=60 + i * 30, sigma=60)
+        noise = noise.gaussblur(12)
+        card = noise.bandjoin([noise.rot180(), noise.flip("horizontal")])
+        card = card.cast("uchar").copy(interpretation="srgb")
+        entry = image.make_card_previews(card)
+        entry["uncropped"] = image.make_uncropped_preview(card)
+        previews.append(entry)
+    return previews
+
+
+def preview_data(entry, kind):
+    return entry["data"] if kind == "data" else entry[kind]["data"]
+
+
+def json_startup(path, names):
+    # json.load of the whole cache and an eval per card widget, as before
+    with open(path, "r") as fp:
+        img_dict = json.load(fp)
+    for name in names:
+        eval(img_dict[name]["data"])
+    return img_dict
+
+
+def json_refresh(img_dict, names, kind):
+    for name in names:
+        eval(preview_data(img_dict[name], kind))
+
+
+def cache_startup(path, names):
+    # Card widgets read every card's preview and size
+    img_dict = PreviewCache()
+    img_dict.open(path)
+    for name in names:
+        img_dict[name]["data"]
+        img_dict[name]["size"]
+    return img_dict
+
+
+def cache_refresh(img_dict, names, kind):
+    for name in names:
+        preview_data(img_dict[name], kind)
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return (time.perf_counter() - start, result)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--cards", type=int, default=3000)
+    parser.add_argument("--refreshes", type=int, default=3)
+    parser.add_argument("--bleed", action="store_true")
+    args = parser.parse_args()
+
+    previews = make_previews(4)
+    names = [f"card{i}.png" for i in range(args.cards)]
+    entries = {name: previews[i % len(previews)] for i, name in enumerate(names)}
+    kind = "uncropped" if args.bleed else "data"
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        json_path = os.path.join(work_dir, "img.json")
+        json_entries = {
+            name: {
+                "data": str(entry["data"]),
+                "size": entry["size"],
+                "uncropped": {
+                    "data": str(entry["uncropped"]["data"]),
+                    "size": entry["uncropped"]["size"],
+                },
+            }
+            for name, entry in entries.items()
+        }
+        with open(json_path, "w") as fp:
+            json.dump(json_entries, fp)
+        del json_entries
+
+        cache_path = os.path.join(work_dir, "img.cache")
+        img_dict = PreviewCache()
+        img_dict.open(cache_path)
+        img_dict.update_entries(entries)
+        img_dict.close()
+
+        size = os.path.getsize(cache_path) / 1024 / 1024
+        print(f"{args.cards} cards, {size:.0f}MB preview cache")
+
+        for label, startup, refresh, path in [
+            ("json", json_startup, json_refresh, json_path),
+            ("cache", cache_startup, cache_refresh, cache_path),
+        ]:
+            (startup_time, img_dict) = timed(startup, path, names)
+            refresh_times = [
+                timed(refresh, img_dict, names, kind)[0]
+                for _ in range(args.refreshes)
+            ]
+            print(
+                f"{label}: startup {startup_time:.2f}s, refresh "
+                + ", ".join(f"{refresh_time:.3f}s" for refresh_time in refresh_times)
+            )
+            if isinstance(img_dict, PreviewCache):
+                img_dict.close()
+            del img_dict
+
+
+if __name__ == "__main__":
+    main()
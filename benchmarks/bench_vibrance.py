@@ -0,0 +1,59 @@
+# Times image.vibrance_bump against the numpy round-trip it replaced on generated
+# card crops,
+#   python benchmarks/bench_vibrance.py [--dpi DPI] [--repeat N]
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pyvips
+from PIL import Image as PIL_Image
+
+import image
+
+
+def numpy_vibrance_bump(img):
+    return pyvips.Image.new_from_array(
+        PIL_Image.fromarray(img.numpy()).filter(image.get_vibrance_cube())
+    )
+
+
+def make_card(dpi, bands):
+    width, height = int(2.48 * dpi), int(3.46 * dpi)
+    noise = pyvips.Image.gaussnoise(width, height, mean=128, sigma=80)
+    card = noise.bandjoin([noise.rot180(), noise.flip("horizontal")])
+    if bands == 4:
+        card = card.bandjoin(noise.flip("vertical"))
+    return card.cast("uchar").copy(interpretation="srgb").copy_memory()
+
+
+def best_time(fn, img, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(img).write_to_memory()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dpi", type=int, default=1200)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    image.get_vibrance_cube()
+    for bands in (3, 4):
+        card = make_card(args.dpi, bands)
+        old = best_time(numpy_vibrance_bump, card, args.repeat)
+        new = best_time(image.vibrance_bump, card, args.repeat)
+        print(
+            f"{card.width}x{card.height} {'RGBA' if bands == 4 else 'RGB'}: "
+            f"numpy {old:.3f}s, vibrance_bump {new:.3f}s, {old / new:.2f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
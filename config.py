@@ -7,6 +7,10 @@ class GlobalConfig:
     def __init__(self):
         self.VibranceBump = False
         self.MaxDPI = 1200
+        self.CropperJobs = os.cpu_count() or 1
+        self.RenderJobs = 1
+        self.RenderCacheMB = 256
+        self.RenderChunkPages = 0
         self.DefaultPageSize = "Letter"
         self.EnableUncrop = True
         self.DisplayColumns = 5
@@ -21,6 +25,12 @@ def load_config() -> GlobalConfig:
         def_cfg = config_parser["DEFAULT"]
         parsed_config.VibranceBump = def_cfg.getboolean("Vibrance.Bump", False)
         parsed_config.MaxDPI = def_cfg.getint("Max.DPI", 1200)
+        parsed_config.CropperJobs = max(
+            def_cfg.getint("Cropper.Jobs", parsed_config.CropperJobs), 1
+        )
+        parsed_config.RenderJobs = max(def_cfg.getint("Render.Jobs", 1), 1)
+        parsed_config.RenderCacheMB = max(def_cfg.getint("Render.CacheMB", 256), 0)
+        parsed_config.RenderChunkPages = max(def_cfg.getint("Render.ChunkPages", 0), 0)
         parsed_config.DefaultPageSize = def_cfg.get("Page.Size", "Letter")
         parsed_config.EnableUncrop = def_cfg.getboolean("Enable.Uncrop", True)
         parsed_config.DisplayColumns = def_cfg.getint("Display.Columns", 5)
@@ -36,6 +46,10 @@ def save_config(cfg):
     def_cfg = config_parser["DEFAULT"]
     def_cfg["Vibrance.Bump"] = str(cfg.VibranceBump)
     def_cfg["Max.DPI"] = str(cfg.MaxDPI)
+    def_cfg["Cropper.Jobs"] = str(cfg.CropperJobs)
+    def_cfg["Render.Jobs"] = str(cfg.RenderJobs)
+    def_cfg["Render.CacheMB"] = str(cfg.RenderCacheMB)
+    def_cfg["Render.ChunkPages"] = str(cfg.RenderChunkPages)
     def_cfg["Page.Size"] = cfg.DefaultPageSize
     def_cfg["Enable.Uncrop"] = str(cfg.EnableUncrop)
     def_cfg["Display.Columns"] = str(cfg.DisplayColumns)
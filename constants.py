@@ -12,6 +12,26 @@ page_sizes = {
     "Legal": paper_sizes()["legal"],
 }
 
+# Resolution cards are embedded at (None keeps the crops as they are), JPEG quality
+# for re-encoded images (None keeps them lossless) and options for `Document.save`
+output_profiles = {
+    "Archive": {
+        "dpi": None,
+        "jpeg_quality": None,
+        "save_options": {"garbage": 3, "deflate": True},
+    },
+    "Print": {
+        "dpi": 600,
+        "jpeg_quality": 90,
+        "save_options": {"garbage": 3, "deflate": True},
+    },
+    "Draft": {
+        "dpi": 300,
+        "jpeg_quality": 75,
+        "save_options": {"garbage": 3, "deflate": True},
+    },
+}
+
 card_size_with_bleed_inch = (2.72, 3.7)
 card_size_without_bleed_inch = (2.48, 3.46)
 card_ratio = card_size_without_bleed_inch[0] / card_size_without_bleed_inch[1]
@@ -390,7 +390,7 @@ class CardImage(QLabel):
 class BacksideImage(CardImage):
     def __init__(self, backside_name, img_dict):
         if backside_name in img_dict:
-            backside_data = eval(img_dict[backside_name]["data"])
+            backside_data = img_dict[backside_name]["data"]
             backside_size = img_dict[backside_name]["size"]
         else:
             backside_data = fallback.data
@@ -512,7 +512,7 @@ class CardWidget(QWidget):
         super().__init__()
 
         if card_name in img_dict:
-            img_data = eval(img_dict[card_name]["data"])
+            img_data = img_dict[card_name]["data"]
             img_size = img_dict[card_name]["size"]
         else:
             img_data = fallback.data
@@ -1059,20 +1059,12 @@ class PrintPreview(QScrollArea):
 
     def refresh(self, print_dict, img_dict):
         bleed_edge = float(print_dict["bleed_edge"])
-        bleed_edge_inch = mm_to_inch(bleed_edge)
 
-        page_size = page_sizes[print_dict["pagesize"]]
-        if print_dict["orient"] == "Landscape":
-            page_size = tuple(page_size[::-1])
+        layout_dict = pdf.resolve_page_layout(print_dict)
+        (_, page_size, (columns, rows)) = pdf.get_page_layout(
+            layout_dict, page_sizes[layout_dict["pagesize"]]
+        )
         page_size = tuple(point_to_inch(p) for p in page_size)
-        (page_width, page_height) = page_size
-
-        (card_width, card_height) = card_size_without_bleed_inch
-        card_width = card_width + 2 * bleed_edge_inch
-        card_height = card_height + 2 * bleed_edge_inch
-
-        columns = int(page_width // card_width)
-        rows = int(page_height // card_height)
 
         raw_pages = pdf.distribute_cards_to_pages(print_dict, columns, rows)
         pages = [
@@ -1102,12 +1094,12 @@ class PrintPreview(QScrollArea):
             if card_name in img_dict:
                 card_img = img_dict[card_name]
                 if bleed_edge > 0 and "uncropped" in card_img:
-                    uncropped_data = eval(card_img["uncropped"]["data"])
+                    uncropped_data = card_img["uncropped"]["data"]
                     img = image.image_from_bytes(uncropped_data)
                     img_crop = image.crop_image(img, "", bleed_edge, None)
                     img_data, img_size = image.to_bytes(img_crop)
                 else:
-                    img_data = eval(card_img["data"])
+                    img_data = card_img["data"]
                     img_size = card_img["size"]
                 return img_data, img_size
             else:
@@ -1140,6 +1132,26 @@ class PrintPreview(QScrollArea):
             )
             bleed_info.setStyleSheet("QLabel { color : red; }")
             header_layout.addWidget(bleed_info)
+        if print_dict["pagesize"] == "Auto":
+            layouts = pdf.rank_page_layouts(print_dict)
+            layout_info = QLabel(
+                f"Auto layout: {layout_dict['pagesize']} {layout_dict['orient']}"
+            )
+            layout_info.setToolTip(
+                "\n".join(
+                    f"{layout['pagesize']} {layout['orient']}: "
+                    f"{layout['columns']}x{layout['rows']} cards, "
+                    f"{layout['sheets']} sheets, "
+                    f"{layout['margin']:.0%} margin"
+                    for layout in layouts
+                )
+            )
+            header_layout.addWidget(layout_info)
+        if print_dict["optimize_packing"]:
+            saved_pages = pdf.get_saved_pages(print_dict, columns, rows)
+            header_layout.addWidget(
+                QLabel(f"Optimized packing saves {saved_pages} pages")
+            )
         if CFG.VibranceBump:
             vibrance_info = QLabel("Preview does not respect 'Vibrance Bump' setting")
             vibrance_info.setStyleSheet("QLabel { color : red; }")
@@ -1205,7 +1217,7 @@ class ActionsWidget(QGroupBox):
             image_dir = print_dict["image_dir"]
             crop_dir = os.path.join(image_dir, "crop")
             if image.need_run_cropper(
-                image_dir, crop_dir, bleed_edge, CFG.VibranceBump
+                image_dir, crop_dir, bleed_edge, CFG.MaxDPI, CFG.VibranceBump
             ):
                 QToolTip.showText(
                     QCursor.pos(),
@@ -1223,12 +1235,15 @@ class ActionsWidget(QGroupBox):
                         else "_printme.pdf"
                     ),
                 )
+                render_dict = pdf.resolve_page_layout(print_dict)
                 pdf.generate(
-                    print_dict,
+                    render_dict,
                     crop_dir,
-                    page_sizes[print_dict["pagesize"]],
+                    page_sizes[render_dict["pagesize"]],
                     pdf_path,
                     make_popup_print_fn(render_window),
+                    CFG.RenderJobs,
+                    CFG.RenderChunkPages,
                 )
                 try:
                     subprocess.Popen([pdf_path], shell=True)
@@ -1247,9 +1262,8 @@ class ActionsWidget(QGroupBox):
             bleed_edge = float(print_dict["bleed_edge"])
             image_dir = print_dict["image_dir"]
             crop_dir = os.path.join(image_dir, "crop")
-            img_cache = print_dict["img_cache"]
             if image.need_run_cropper(
-                image_dir, crop_dir, bleed_edge, CFG.VibranceBump
+                image_dir, crop_dir, bleed_edge, CFG.MaxDPI, CFG.VibranceBump
             ):
 
                 self._rebuild_after_cropper = False
@@ -1258,13 +1272,13 @@ class ActionsWidget(QGroupBox):
                     image.cropper(
                         image_dir,
                         crop_dir,
-                        img_cache,
                         img_dict,
                         bleed_edge,
                         CFG.MaxDPI,
                         CFG.VibranceBump,
                         CFG.EnableUncrop,
                         make_popup_print_fn(crop_window),
+                        CFG.CropperJobs,
                     )
 
                     for img in image.list_image_files(crop_dir):
@@ -1342,7 +1356,7 @@ class ActionsWidget(QGroupBox):
                 image_dir = new_image_dir
                 crop_dir = os.path.join(image_dir, "crop")
                 if image.need_run_cropper(
-                    image_dir, crop_dir, bleed_edge, CFG.VibranceBump
+                    image_dir, crop_dir, bleed_edge, CFG.MaxDPI, CFG.VibranceBump
                 ) or image.need_cache_previews(crop_dir, img_dict):
 
                     def reload_work():
@@ -1384,11 +1398,31 @@ class PrintOptionsWidget(QGroupBox):
 
         print_output = LineEditWithLabel("PDF &Filename", print_dict["filename"])
         paper_size = ComboBoxWithLabel(
-            "&Paper Size", list(page_sizes.keys()), print_dict["pagesize"]
+            "&Paper Size", [*page_sizes.keys(), "Auto"], print_dict["pagesize"]
+        )
+        paper_size.setToolTip(
+            "Auto picks the paper size and orientation that need the fewest sheets"
         )
         orientation = ComboBoxWithLabel(
             "&Orientation", ["Landscape", "Portrait"], print_dict["orient"]
         )
+        orientation._widget.setEnabled(print_dict["pagesize"] != "Auto")
+        output_profile = ComboBoxWithLabel(
+            "Ou&tput Profile",
+            list(output_profiles.keys()),
+            print_dict["output_profile"],
+        )
+        output_profile.setToolTip(
+            "Archive keeps cards as cropped, Print and Draft embed them at "
+            "600 and 300 DPI as JPEG for smaller and faster pdfs"
+        )
+
+        optimize_packing_checkbox = QCheckBox("Optimize Packing")
+        optimize_packing_checkbox.setChecked(print_dict["optimize_packing"])
+        optimize_packing_checkbox.setToolTip(
+            "Mix oversized and regular cards on pages so that the fewest pages are "
+            "needed, instead of filling pages in card order"
+        )
 
         guides_checkbox = QCheckBox("Enable Guides")
         guides_checkbox.setChecked(print_dict["enable_guides"])
@@ -1418,6 +1452,8 @@ class PrintOptionsWidget(QGroupBox):
         layout.addWidget(print_output)
         layout.addWidget(paper_size)
         layout.addWidget(orientation)
+        layout.addWidget(output_profile)
+        layout.addWidget(optimize_packing_checkbox)
         layout.addWidget(guides_checkbox)
         layout.addWidget(extended_guides_checkbox)
         layout.addWidget(guides_color_a)
@@ -1430,12 +1466,21 @@ class PrintOptionsWidget(QGroupBox):
 
         def change_papersize(t):
             print_dict["pagesize"] = t
+            self._orientation.setEnabled(t != "Auto")
             self.window().refresh_preview(print_dict, img_dict)
 
         def change_orientation(t):
             print_dict["orient"] = t
             self.window().refresh_preview(print_dict, img_dict)
 
+        def change_output_profile(t):
+            print_dict["output_profile"] = t
+
+        def change_optimize_packing(s):
+            enabled = s == QtCore.Qt.CheckState.Checked
+            print_dict["optimize_packing"] = enabled
+            self.window().refresh_preview(print_dict, img_dict)
+
         def change_guides(s):
             enabled = s == QtCore.Qt.CheckState.Checked
             print_dict["enable_guides"] = enabled
@@ -1463,6 +1508,8 @@ class PrintOptionsWidget(QGroupBox):
         print_output._widget.textChanged.connect(change_output)
         paper_size._widget.currentTextChanged.connect(change_papersize)
         orientation._widget.currentTextChanged.connect(change_orientation)
+        output_profile._widget.currentTextChanged.connect(change_output_profile)
+        optimize_packing_checkbox.checkStateChanged.connect(change_optimize_packing)
         guides_checkbox.checkStateChanged.connect(change_guides)
         extended_guides_checkbox.checkStateChanged.connect(change_extended_guides)
         guides_color_a_button.clicked.connect(pick_guides_color_a)
@@ -1471,6 +1518,8 @@ class PrintOptionsWidget(QGroupBox):
         self._print_output = print_output._widget
         self._paper_size = paper_size._widget
         self._orientation = orientation._widget
+        self._output_profile = output_profile._widget
+        self._optimize_packing_checkbox = optimize_packing_checkbox
         self._guides_checkbox = guides_checkbox
         self._extended_guides_checkbox = extended_guides_checkbox
         self._guides_color_a = guides_color_a
@@ -1480,6 +1529,9 @@ class PrintOptionsWidget(QGroupBox):
         self._print_output.setText(print_dict["filename"])
         self._paper_size.setCurrentText(print_dict["pagesize"])
         self._orientation.setCurrentText(print_dict["orient"])
+        self._orientation.setEnabled(print_dict["pagesize"] != "Auto")
+        self._output_profile.setCurrentText(print_dict["output_profile"])
+        self._optimize_packing_checkbox.setChecked(print_dict["optimize_packing"])
         self._guides_checkbox.setChecked(print_dict["enable_guides"])
         self._extended_guides_checkbox.setChecked(print_dict["extended_guides"])
 
@@ -1671,6 +1723,36 @@ class GlobalOptionsWidget(QGroupBox):
         max_dpi = WidgetWithLabel("&Max DPI", max_dpi_spin_box)
         max_dpi.setToolTip("Requires rerunning cropper")
 
+        cropper_jobs_spin_box = QDoubleSpinBox()
+        cropper_jobs_spin_box.setDecimals(0)
+        cropper_jobs_spin_box.setRange(1, max(os.cpu_count() or 1, CFG.CropperJobs))
+        cropper_jobs_spin_box.setSingleStep(1)
+        cropper_jobs_spin_box.setValue(CFG.CropperJobs)
+        cropper_jobs = WidgetWithLabel("Cropper &Jobs", cropper_jobs_spin_box)
+        cropper_jobs.setToolTip("Number of images cropped in parallel")
+
+        render_jobs_spin_box = QDoubleSpinBox()
+        render_jobs_spin_box.setDecimals(0)
+        render_jobs_spin_box.setRange(1, max(os.cpu_count() or 1, CFG.RenderJobs))
+        render_jobs_spin_box.setSingleStep(1)
+        render_jobs_spin_box.setValue(CFG.RenderJobs)
+        render_jobs = WidgetWithLabel("&Render Jobs", render_jobs_spin_box)
+        render_jobs.setToolTip("Number of processes rendering pdf pages in parallel")
+
+        render_chunk_pages_spin_box = QDoubleSpinBox()
+        render_chunk_pages_spin_box.setDecimals(0)
+        render_chunk_pages_spin_box.setRange(0, 10000)
+        render_chunk_pages_spin_box.setSingleStep(50)
+        render_chunk_pages_spin_box.setValue(CFG.RenderChunkPages)
+        render_chunk_pages = WidgetWithLabel(
+            "Pa&ges Per Save", render_chunk_pages_spin_box
+        )
+        render_chunk_pages.setToolTip(
+            "Write the pdf to disk every this many pages while rendering, keeps "
+            "memory usage low for very large pdfs, 0 saves only once at the end, "
+            "not used with more than one render job"
+        )
+
         paper_sizes = ComboBoxWithLabel(
             "Default P&aper Size", list(page_sizes.keys()), CFG.DefaultPageSize
         )
@@ -1680,6 +1762,9 @@ class GlobalOptionsWidget(QGroupBox):
         layout.addWidget(precropped_checkbox)
         layout.addWidget(vibrance_checkbox)
         layout.addWidget(max_dpi)
+        layout.addWidget(cropper_jobs)
+        layout.addWidget(render_jobs)
+        layout.addWidget(render_chunk_pages)
         layout.addWidget(paper_sizes)
 
         self.setLayout(layout)
@@ -1704,6 +1789,18 @@ class GlobalOptionsWidget(QGroupBox):
             CFG.MaxDPI = int(v)
             save_config(CFG)
 
+        def change_cropper_jobs(v):
+            CFG.CropperJobs = int(v)
+            save_config(CFG)
+
+        def change_render_jobs(v):
+            CFG.RenderJobs = int(v)
+            save_config(CFG)
+
+        def change_render_chunk_pages(v):
+            CFG.RenderChunkPages = int(v)
+            save_config(CFG)
+
         def change_papersize(t):
             CFG.DefaultPageSize = t
             save_config(CFG)
@@ -1713,6 +1810,9 @@ class GlobalOptionsWidget(QGroupBox):
         precropped_checkbox.checkStateChanged.connect(change_precropped)
         vibrance_checkbox.checkStateChanged.connect(change_vibrance_bump)
         max_dpi_spin_box.valueChanged.connect(change_max_dpi)
+        cropper_jobs_spin_box.valueChanged.connect(change_cropper_jobs)
+        render_jobs_spin_box.valueChanged.connect(change_render_jobs)
+        render_chunk_pages_spin_box.valueChanged.connect(change_render_chunk_pages)
         paper_sizes._widget.currentTextChanged.connect(change_papersize)
 
 
@@ -1,17 +1,28 @@
 import io
 import json
 import base64
+import hashlib
+import threading
 from enum import Enum
+from concurrent.futures import ThreadPoolExecutor
 
 from PIL import Image as PIL_Image
 from PIL import ImageFilter as PIL_ImageFilter
 import pyvips
 
+import preview_cache
 from util import *
 from constants import *
 
 
 vibrance_cube = None
+vibrance_cube_lock = threading.Lock()
+# Bump this whenever changes to the cropping code alter its output
+crop_algorithm_version = 1
+crop_manifest_name = ".manifest.json"
+preview_width = 248
+thumbnail_scale = 0.45
+uncropped_preview_width = 186
 valid_image_extensions = [
     ".gif",
     ".jpg",
@@ -24,16 +35,46 @@ def list_image_files(dir):
     return list_files(dir, valid_image_extensions)
 
 
-def init():
-    with open(os.path.join(resource_path(), "vibrance.CUBE")) as f:
-        lut_raw = f.read().splitlines()[11:]
+def load_vibrance_table():
+    import numpy
 
-    lsize = round(len(lut_raw) ** (1 / 3))
-    row2val = lambda row: tuple([float(val) for val in row.split(" ")])
-    lut_table = [row2val(row) for row in lut_raw]
+    cube_path = os.path.join(resource_path(), "vibrance.CUBE")
+    cache_path = os.path.join(resource_path(), "vibrance.npz")
 
+    with open(cube_path, "rb") as f:
+        cube_data = f.read()
+    cube_hash = hashlib.sha1(cube_data).hexdigest()
+
+    try:
+        with numpy.load(cache_path) as cache:
+            if str(cache["hash"]) == cube_hash:
+                return cache["table"]
+    except (OSError, ValueError, KeyError):
+        pass
+
+    lut_raw = cube_data.decode().splitlines()[11:]
+    row2val = lambda row: [float(val) for val in row.split(" ")]
+    lut_table = numpy.array([row2val(row) for row in lut_raw], dtype=numpy.float32)
+
+    # Writing the cache is best-effort, e.g. the install folder may be read-only
+    try:
+        with open(f"{cache_path}.tmp", "wb") as f:
+            numpy.savez(f, hash=cube_hash, table=lut_table)
+        os.replace(f"{cache_path}.tmp", cache_path)
+    except OSError:
+        pass
+
+    return lut_table
+
+
+def get_vibrance_cube():
     global vibrance_cube
-    vibrance_cube = PIL_ImageFilter.Color3DLUT(lsize, lut_table)
+    with vibrance_cube_lock:
+        if vibrance_cube is None:
+            lut_table = load_vibrance_table()
+            lsize = round(len(lut_table) ** (1 / 3))
+            vibrance_cube = PIL_ImageFilter.Color3DLUT(lsize, lut_table)
+    return vibrance_cube
 
 
 def init_image_folder(image_dir, crop_dir):
@@ -66,25 +107,199 @@ def read_image(path) -> pyvips.Image:
     return pyvips.Image.new_from_file(path)
 
 
+def thumbnail_image(path_or_image, width) -> pyvips.Image:
+    # Fit to width only, libvips then decodes at a reduced scale where the format
+    # allows it (e.g. JPEG shrink-on-load) instead of reading the full image
+    height = 10 * width
+    if isinstance(path_or_image, pyvips.Image):
+        return path_or_image.thumbnail_image(width, height=height, no_rotate=True)
+    return pyvips.Image.thumbnail(path_or_image, width, height=height, no_rotate=True)
+
+
+def downscale_image(path, max_size) -> pyvips.Image:
+    # Fits into a square of `max_size` but never upscales
+    return pyvips.Image.thumbnail(
+        path, max_size, height=max_size, size=pyvips.enums.Size.DOWN, no_rotate=True
+    )
+
+
 def write_image(path, image: pyvips.Image):
     image.write_to_file(path)
 
 
-def need_run_cropper(image_dir, crop_dir, bleed_edge, do_vibrance_bump):
-    has_bleed_edge = bleed_edge is not None and bleed_edge > 0
-
+def crop_output_dir(crop_dir, bleed_edge, do_vibrance_bump):
     output_dir = crop_dir
     if do_vibrance_bump:
         output_dir = os.path.join(output_dir, "vibrance")
-    if has_bleed_edge:
+    if bleed_edge is not None and bleed_edge > 0:
         output_dir = os.path.join(output_dir, str(bleed_edge).replace(".", "p"))
+    return output_dir
+
+
+def crop_variants(crop_dir, bleed_edge, do_vibrance_bump):
+    # (output_dir, bleed_edge, do_vibrance_bump) for every folder the cropper fills,
+    # the plain crop always comes first since previews are generated from it
+    variants = [(crop_dir, None, False)]
+    if do_vibrance_bump:
+        variants.append((crop_output_dir(crop_dir, None, True), None, True))
+    if bleed_edge is not None and bleed_edge > 0:
+        variants.append(
+            (
+                crop_output_dir(crop_dir, bleed_edge, do_vibrance_bump),
+                bleed_edge,
+                do_vibrance_bump,
+            )
+        )
+    return variants
+
+
+def file_signature(path, signature=None):
+    # Only hash the file if it was touched since the known signature was taken
+    stat = os.stat(path)
+    if (
+        signature is not None
+        and signature["mtime"] == stat.st_mtime_ns
+        and signature["size"] == stat.st_size
+    ):
+        return signature
+
+    file_hash = hashlib.sha1()
+    with open(path, "rb") as fp:
+        while chunk := fp.read(1 << 20):
+            file_hash.update(chunk)
+    return {
+        "mtime": stat.st_mtime_ns,
+        "size": stat.st_size,
+        "hash": file_hash.hexdigest(),
+    }
+
+
+def crop_params(bleed_edge, max_dpi, do_vibrance_bump):
+    return {
+        "version": crop_algorithm_version,
+        "bleed_edge": bleed_edge,
+        "max_dpi": max_dpi,
+        "vibrance_bump": do_vibrance_bump,
+    }
+
+
+def load_crop_manifest(output_dir):
+    try:
+        with open(os.path.join(output_dir, crop_manifest_name), "r") as fp:
+            return json.load(fp)
+    except (OSError, ValueError):
+        return None
+
 
-    if not os.path.exists(output_dir):
-        return True
+def save_crop_manifest(output_dir, manifest):
+    manifest_path = os.path.join(output_dir, crop_manifest_name)
+    with open(f"{manifest_path}.tmp", "w") as fp:
+        json.dump(manifest, fp)
+    os.replace(f"{manifest_path}.tmp", manifest_path)
 
+
+def update_crop_manifest(image_dir, output_dir, input_files, params):
+    """Returns the manifest of `output_dir` and the input files that have to be cropped,
+    only sources that were touched since the last run are hashed again."""
+    output_files = (
+        set(list_image_files(output_dir)) if os.path.exists(output_dir) else set()
+    )
+
+    manifest = load_crop_manifest(output_dir)
+    if manifest is None:
+        # Adopt crops made before manifests existed instead of recropping everything
+        manifest = {
+            "params": params,
+            "files": {
+                img_file: {
+                    "source": file_signature(os.path.join(image_dir, img_file))
+                }
+                for img_file in input_files
+                if img_file in output_files
+            },
+        }
+        changed = os.path.exists(output_dir)
+    else:
+        changed = False
+
+    files = manifest["files"]
+    params_changed = manifest["params"] != params
+
+    stale_files = []
+    for img_file in input_files:
+        entry = files.get(img_file)
+        if (
+            entry is None
+            or img_file not in output_files
+            or (params_changed and not entry.get("precropped", False))
+        ):
+            stale_files.append(img_file)
+            continue
+
+        source = entry["source"]
+        signature = file_signature(os.path.join(image_dir, img_file), source)
+        if signature["hash"] != source["hash"]:
+            stale_files.append(img_file)
+        elif signature is not source:
+            entry["source"] = signature
+            changed = True
+
+    input_file_set = set(input_files)
+    for img_file in list(files.keys()):
+        if img_file not in input_file_set:
+            del files[img_file]
+            changed = True
+
+    if changed:
+        save_crop_manifest(output_dir, manifest)
+
+    return manifest, stale_files
+
+
+def need_run_cropper(image_dir, crop_dir, bleed_edge, max_dpi, do_vibrance_bump):
     input_files = list_image_files(image_dir)
-    output_files = list_image_files(output_dir)
-    return sorted(input_files) != sorted(output_files)
+    input_file_set = set(input_files)
+    for output_dir, variant_bleed_edge, variant_vibrance_bump in crop_variants(
+        crop_dir, bleed_edge, do_vibrance_bump
+    ):
+        if not os.path.exists(output_dir):
+            return True
+
+        # Extra files are either pre-cropped images or left over from removed images
+        if any(
+            img_file not in input_file_set
+            for img_file in list_image_files(output_dir)
+        ):
+            return True
+
+        params = crop_params(variant_bleed_edge, max_dpi, variant_vibrance_bump)
+        _, stale_files = update_crop_manifest(
+            image_dir, output_dir, input_files, params
+        )
+        if stale_files:
+            return True
+
+    return False
+
+
+def vibrance_bump(image: pyvips.Image) -> pyvips.Image:
+    if image.format != "uchar" or image.bands < 3:
+        image = image.colourspace(pyvips.enums.Interpretation.SRGB)
+
+    # Hand the raw samples over to Pillow's fixed-point LUT kernel without going
+    # through intermediate numpy arrays, alpha is passed through unchanged
+    mode = "RGBA" if image.bands == 4 else "RGB"
+    if image.bands > 4:
+        image = image.extract_band(0, n=4)
+    w, h = image.width, image.height
+
+    pil_image = PIL_Image.frombuffer(
+        mode, (w, h), image.write_to_memory(), "raw", mode, 0, 1
+    )
+    pil_image = pil_image.filter(get_vibrance_cube())
+    return pyvips.Image.new_from_memory(
+        pil_image.tobytes(), w, h, len(mode), pyvips.enums.BandFormat.UCHAR
+    ).copy(interpretation=pyvips.enums.Interpretation.SRGB)
 
 
 def crop_image(
@@ -140,79 +355,128 @@ def uncrop_image(image: pyvips.Image, image_name, print_fn=None) -> pyvips.Image
 def cropper(
     image_dir,
     crop_dir,
-    img_cache,
     img_dict,
     bleed_edge,
     max_dpi,
     do_vibrance_bump,
     uncrop,
     print_fn,
+    jobs=1,
 ):
-    has_bleed_edge = bleed_edge is not None and bleed_edge > 0
-    if has_bleed_edge:
-        cropper(
-            image_dir,
-            crop_dir,
-            img_cache,
-            img_dict,
-            None,
-            max_dpi,
-            do_vibrance_bump,
-            uncrop,
-            print_fn,
-        )
-    elif do_vibrance_bump:
-        cropper(
-            image_dir,
-            crop_dir,
-            img_cache,
-            img_dict,
-            None,
-            max_dpi,
-            False,
-            uncrop,
-            print_fn,
+    variants = crop_variants(crop_dir, bleed_edge, do_vibrance_bump)
+    for output_dir, _, _ in variants:
+        if not os.path.exists(output_dir):
+            os.makedirs(output_dir)
+
+    # Pre-cropped images only live in the plain crop folder, reinsert their bleed
+    # edge so that every other variant can be cropped from the new source image
+    precropped_files = []
+    for output_dir, _, _ in variants:
+        extra_files = []
+
+        output_files = list_image_files(output_dir)
+        for img_file in output_files:
+            if not os.path.exists(os.path.join(image_dir, img_file)):
+                extra_files.append(img_file)
+
+        if uncrop and output_dir == crop_dir:
+            for extra_img in extra_files:
+                image = read_image(os.path.join(output_dir, extra_img))
+                uncropped_image = uncrop_image(image, extra_img, print_fn)
+                write_image(os.path.join(image_dir, extra_img), uncropped_image)
+            precropped_files = extra_files
+        else:
+            for extra in extra_files:
+                os.remove(os.path.join(output_dir, extra))
+
+    input_files = list_image_files(image_dir)
+
+    manifests = {}
+    stale_variants = {}
+    for variant in variants:
+        output_dir, variant_bleed_edge, variant_vibrance_bump = variant
+        params = crop_params(variant_bleed_edge, max_dpi, variant_vibrance_bump)
+        manifest, stale_files = update_crop_manifest(
+            image_dir, output_dir, input_files, params
         )
+        manifest["params"] = params
+        manifests[output_dir] = manifest
+
+        if output_dir == crop_dir:
+            # The crop of a pre-cropped image is the original, never overwrite it
+            for img_file in precropped_files:
+                manifest["files"][img_file] = {
+                    "source": file_signature(os.path.join(image_dir, img_file)),
+                    "precropped": True,
+                }
+            stale_files = [f for f in stale_files if f not in precropped_files]
 
-    output_dir = crop_dir
-    if do_vibrance_bump:
-        output_dir = os.path.join(output_dir, "vibrance")
-    if has_bleed_edge:
-        output_dir = os.path.join(output_dir, str(bleed_edge).replace(".", "p"))
-    if not os.path.exists(output_dir):
-        os.makedirs(output_dir)
+        for img_file in stale_files:
+            stale_variants.setdefault(img_file, []).append(variant)
 
-    input_files = list_image_files(image_dir)
-    for img_file in input_files:
-        if os.path.exists(os.path.join(output_dir, img_file)):
-            continue
+    def crop_file(img_file):
+        missing = stale_variants[img_file]
+        make_previews = missing[0][0] == crop_dir
 
+        # Decode the source once and derive all variants and previews from the same
+        # pixels, otherwise libvips would lazily re-read the file for every output
+        reuse_pixels = len(missing) > 1 or make_previews
         image = read_image(os.path.join(image_dir, img_file))
-        cropped_image = crop_image(image, img_file, bleed_edge, max_dpi, print_fn)
-        if do_vibrance_bump:
-            cropped_image = pyvips.Image.new_from_array(
-                PIL_Image.fromarray(cropped_image.numpy()).filter(vibrance_cube)
-            )
-        write_image(os.path.join(output_dir, img_file), cropped_image)
+        if reuse_pixels:
+            image = image.copy_memory()
+
+        cropped_images = {}
+        for output_dir, variant_bleed_edge, variant_vibrance_bump in missing:
+            if variant_bleed_edge not in cropped_images:
+                cropped_image = crop_image(
+                    image, img_file, variant_bleed_edge, max_dpi, print_fn
+                )
+                if reuse_pixels:
+                    cropped_image = cropped_image.copy_memory()
+                cropped_images[variant_bleed_edge] = cropped_image
 
-    extra_files = []
+            cropped_image = cropped_images[variant_bleed_edge]
+            if variant_vibrance_bump:
+                cropped_image = vibrance_bump(cropped_image)
+            write_image(os.path.join(output_dir, img_file), cropped_image)
 
-    output_files = list_image_files(output_dir)
-    for img_file in output_files:
-        if not os.path.exists(os.path.join(image_dir, img_file)):
-            extra_files.append(img_file)
+        previews = None
+        if make_previews:
+            previews = make_card_previews(cropped_images[None])
+            previews["uncropped"] = make_uncropped_preview(image)
 
-    if uncrop and not has_bleed_edge:
-        for extra_img in extra_files:
-            image = read_image(os.path.join(output_dir, extra_img))
-            uncropped_image = uncrop_image(image, extra_img, print_fn)
-            write_image(os.path.join(image_dir, extra_img), uncropped_image)
-    else:
-        for extra in extra_files:
-            os.remove(os.path.join(output_dir, extra))
+        return file_signature(os.path.join(image_dir, img_file)), previews
+
+    stale_input_files = list(stale_variants.keys())
+    results = run_jobs(crop_file, stale_input_files, jobs)
+
+    new_previews = {}
+    for img_file, (signature, previews) in zip(stale_input_files, results):
+        for output_dir, _, _ in stale_variants[img_file]:
+            manifests[output_dir]["files"][img_file] = {"source": signature}
+        if previews is not None:
+            new_previews[img_file] = previews
 
+    for output_dir, manifest in manifests.items():
+        save_crop_manifest(output_dir, manifest)
+
+    if new_previews:
+        img_dict.update_entries(new_previews)
+
+    # Only pre-cropped images should be missing previews at this point
     if need_cache_previews(crop_dir, img_dict):
-        cache_previews(img_cache, image_dir, crop_dir, print_fn, img_dict)
+        cache_previews(image_dir, crop_dir, print_fn, img_dict)
+
+
+def run_jobs(fn, items, jobs):
+    # libvips releases the GIL while decoding/encoding, so threads scale fine
+    # and let workers keep reporting progress through a shared print_fn
+    jobs = min(max(jobs or 1, 1), len(items))
+    if jobs <= 1:
+        return [fn(item) for item in items]
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        return list(executor.map(fn, items))
 
 
 def image_from_bytes(bytes) -> pyvips.Image:
@@ -238,6 +502,14 @@ def image_to_bytes(img: pyvips.Image):
     return bio.getvalue()
 
 
+def image_to_jpeg_bytes(img: pyvips.Image, quality):
+    if img.hasalpha():
+        img = img.flatten(background=255)
+    if img.format != "uchar" or img.interpretation not in ("srgb", "b-w"):
+        img = img.colourspace("srgb" if img.bands >= 3 else "b-w")
+    return img.write_to_buffer(".jpg", Q=quality)
+
+
 def to_bytes(file_or_bytes, resize=None):
     if isinstance(file_or_bytes, pyvips.Image):
         img = file_or_bytes
@@ -258,88 +530,83 @@ def to_bytes(file_or_bytes, resize=None):
     return image_to_bytes(img), (cur_width, cur_height)
 
 
+def make_preview(img: pyvips.Image):
+    image_data, image_size = to_bytes(img)
+    return {
+        "data": image_data,
+        "size": image_size,
+    }
+
+
+def make_card_previews(cropped_image: pyvips.Image):
+    preview = thumbnail_image(cropped_image, preview_width).copy_memory()
+    previews = make_preview(preview)
+    previews["thumb"] = make_preview(
+        thumbnail_image(preview, round(preview.width * thumbnail_scale))
+    )
+    return previews
+
+
+def make_uncropped_preview(path_or_image):
+    return make_preview(thumbnail_image(path_or_image, uncropped_preview_width))
+
+
 def need_cache_previews(crop_dir, img_dict):
-    crop_list = list_image_files(crop_dir)
+    crop_list = set(list_image_files(crop_dir))
 
     for img in crop_list:
-        if img not in img_dict.keys():
+        if img not in img_dict:
             return True
 
-    for img, value in img_dict.items():
-        if (
-            "size" not in value
-            or "thumb" not in value
-            or "uncropped" not in value
-            or img not in crop_list
+    for img in img_dict:
+        if img not in crop_list or any(
+            kind not in img_dict.kinds(img) for kind in preview_cache.preview_kinds
         ):
             return True
 
     return False
 
 
-def cache_previews(file, image_dir, crop_dir, print_fn, data):
-    deleted_cards = []
-    for img in data.keys():
-        fn = os.path.join(crop_dir, img)
-        if not os.path.exists(fn):
-            deleted_cards.append(img)
-
-    for img in deleted_cards:
-        del data[img]
+def cache_previews(image_dir, crop_dir, print_fn, data):
+    crop_list = list_image_files(crop_dir)
+    crop_set = set(crop_list)
 
-    for f in list_files(crop_dir, valid_image_extensions):
-        has_img = f in data
-        img_dict = data[f] if has_img else None
+    deleted_cards = [img for img in data if img not in crop_set]
 
-        has_size = has_img and "size" in img_dict
-        has_thumbnail = has_img and "thumb" in img_dict
-        need_img = not all([has_img, has_size, has_thumbnail])
+    changed_cards = {}
+    for f in crop_list:
+        kinds = data.kinds(f)
+        need_img = "data" not in kinds or "thumb" not in kinds
 
         if need_img:
-            img = read_image(os.path.join(crop_dir, f))
-            w, h = img.width, img.height
-            scale = 248 / w
-            preview_size = (round(w * scale), round(h * scale))
+            img_dict = dict(data[f]) if f in data else {}
+            img = thumbnail_image(os.path.join(crop_dir, f), preview_width)
+            img = img.copy_memory()
 
-            if not has_img or not has_size:
+            if "data" not in kinds:
                 print_fn(f"Caching preview for image {f}...\n")
 
-                image_data, image_size = to_bytes(img, preview_size)
-                data[f] = {
-                    "data": str(image_data),
-                    "size": image_size,
-                }
-                img_dict = data[f]
+                img_dict.update(make_preview(img))
 
-            if not has_thumbnail:
+            if "thumb" not in kinds:
                 print_fn(f"Caching thumbnail for image {f}...\n")
 
-                thumb_data, thumb_size = to_bytes(
-                    img, (preview_size[0] * 0.45, preview_size[1] * 0.45)
+                img_dict["thumb"] = make_preview(
+                    thumbnail_image(img, round(img.width * thumbnail_scale))
                 )
-                img_dict["thumb"] = {
-                    "data": str(thumb_data),
-                    "size": thumb_size,
-                }
+
+            changed_cards[f] = img_dict
 
     for f in list_files(image_dir, valid_image_extensions):
-        if f in data:
-            img_dict = data[f]
-            has_img = "uncropped" in img_dict
-            if not has_img:
-                img = read_image(os.path.join(image_dir, f))
-                w, h = img.width, img.height
-                scale = 186 / w
-                uncropped_size = (round(w * scale), round(h * scale))
-
-                if not has_img or not has_size:
-                    print_fn(f"Caching uncropped preview for image {f}...\n")
-
-                    image_data, image_size = to_bytes(img, uncropped_size)
-                    img_dict["uncropped"] = {
-                        "data": str(image_data),
-                        "size": image_size,
-                    }
-
-    with open(file, "w") as fp:
-        json.dump(data, fp, ensure_ascii=False)
+        if f in changed_cards or f in data and f in crop_set:
+            if "uncropped" not in data.kinds(f):
+                print_fn(f"Caching uncropped preview for image {f}...\n")
+
+                img_dict = changed_cards.get(f) or dict(data[f])
+                img_dict["uncropped"] = make_uncropped_preview(
+                    os.path.join(image_dir, f)
+                )
+                changed_cards[f] = img_dict
+
+    if changed_cards or deleted_cards:
+        data.update_entries(changed_cards, deleted_cards)
@@ -1,21 +1,20 @@
 import json
+import multiprocessing
 
-import image
 import gui_qt
 import project
+import preview_cache
 from util import *
 from config import *
 from constants import *
 
 def main():
     app = None
-    img_dict = {}
+    img_dict = preview_cache.PreviewCache()
     print_dict = {}
 
 
     def init():
-        image.init()
-
         print_fn = (
             gui_qt.make_popup_print_fn(loading_window)
             if loading_window is not None
@@ -34,6 +33,7 @@ def main():
     window = gui_qt.window_setup(app, print_dict, img_dict)
 
     gui_qt.event_loop(app)
+    img_dict.close()
 
     with open(app.json_path(), "w") as fp:
         json.dump(print_dict, fp)
@@ -41,4 +41,5 @@ def main():
     app.close()
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support()
     main()
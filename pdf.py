@@ -1,14 +1,45 @@
-import io
+import json
+import time
+import hashlib
+import threading
 from enum import Enum
 from copy import deepcopy
-from functools import cache
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
+import pyvips
 import pymupdf
 
 from util import *
 from config import CFG
 from constants import *
-from image import read_image, image_to_bytes, rotate_image, Rotation
+from image import (
+    read_image,
+    downscale_image,
+    image_to_jpeg_bytes,
+    crop_output_dir,
+    file_signature,
+    Rotation,
+)
+
+
+jpeg_image_extensions = [
+    ".jpg",
+    ".jpeg",
+]
+passthrough_image_extensions = [
+    *jpeg_image_extensions,
+    ".png",
+]
+
+# Bump this whenever changes to the rendering code alter its output
+render_version = 4
+
+# Embedded card images carry their file name and the long side they were fit into
+# under these keys, so that a later render finds them whatever object numbers
+# saving gave them and knows whether they are large enough for its placements
+img_name_key = "PPPImage"
+img_size_key = "PPPMaxSize"
 
 
 class CrossSegment(Enum):
@@ -18,46 +49,142 @@ class CrossSegment(Enum):
     BottomLeft = (1, -1)
 
 
-def draw_line(page, c1, c2, fx, fy, tx, ty, s=1):
+# Lines are added to a `pymupdf.Shape`, which is only written to the page on commit
+def draw_line(shape, c1, c2, fx, fy, tx, ty, s=1):
     # First layer
-    page.draw_line([fx, fy], [tx, ty], dashes=f"[{s}] 0", color=c1, width=s)
+    shape.draw_line([fx, fy], [tx, ty])
+    shape.finish(dashes=f"[{s}] 0", color=c1, width=s, closePath=False)
     # Second layer with phase offset
-    page.draw_line([fx, fy], [tx, ty], dashes=f"[{s}] {s}", color=c2, width=s)
+    shape.draw_line([fx, fy], [tx, ty])
+    shape.finish(dashes=f"[{s}] {s}", color=c2, width=s, closePath=False)
 
 
 # Draws black-white dashed cross segment at `(x, y)`, with a width of `c`, and a thickness of `s`
-def draw_cross(page, c1, c2, x, y, segment, c=6, s=1):
+def draw_cross(shape, c1, c2, x, y, segment, c=6, s=1):
     (dx, dy) = segment.value
     (tx, ty) = (x + c * dx, y + c * dy)
 
-    draw_line(page, c1, c2, x, y, tx, y, s)
-    draw_line(page, c1, c2, x, y, x, ty, s)
+    draw_line(shape, c1, c2, x, y, tx, y, s)
+    draw_line(shape, c1, c2, x, y, x, ty, s)
 
 
-def generate(print_dict, crop_dir, size, pdf_path, print_fn):
-    has_backside = print_dict["backside_enabled"]
-    backside_offset = mm_to_point(float(print_dict["backside_offset"]))
+# Draws the form xobject `xref` on top of `page` in the page's own coordinates, which
+# is how `Page.show_pdf_page` places a source page of the same size
+def show_form(page, xref):
+    pdf_document = page.parent
+    page.wrap_contents()
 
+    # The resource dictionaries are either part of the page or objects of their own
+    (dict_xref, path) = (page.xref, "")
+    for key in ["Resources", "XObject"]:
+        (kind, value) = pdf_document.xref_get_key(dict_xref, f"{path}{key}")
+        if kind == "xref":
+            (dict_xref, path) = (int(value.split()[0]), "")
+        else:
+            path = f"{path}{key}/"
+
+    name = f"PPPForm{xref}"
+    pdf_document.xref_set_key(dict_xref, f"{path}{name}", f"{xref} 0 R")
+
+    contents_xref = pdf_document.get_new_xref()
+    pdf_document.update_object(contents_xref, "<<>>")
+    pdf_document.update_stream(contents_xref, f"q /{name} Do Q".encode())
+    contents = [*page.get_contents(), contents_xref]
+    contents = " ".join(f"{xref} 0 R" for xref in contents)
+    pdf_document.xref_set_key(page.xref, "Contents", f"[{contents}]")
+
+
+# Hands decoded samples to PyMuPDF directly instead of a PNG encode and decode,
+# the pixmap itself is only made by `get_insert_args`
+def image_to_samples(img: pyvips.Image):
+    if img.format != "uchar" or img.interpretation not in ("srgb", "b-w"):
+        img = img.colourspace("srgb" if img.bands >= 3 else "b-w")
+
+    alpha = img.hasalpha()
+    if alpha:
+        # MuPDF expects premultiplied samples
+        img = (img.premultiply() + 0.5).cast("uchar")
+
+    return {
+        "samples": bytes(img.write_to_memory()),
+        "size": (img.width, img.height),
+        "gray": img.bands - alpha == 1,
+        "alpha": alpha,
+    }
+
+
+# Returns the `insert_image` arguments for an image from `get_img`, PyMuPDF is not
+# thread safe so this must run on the thread that renders the document
+def get_insert_args(img):
+    if "samples" not in img:
+        return img
+
+    colorspace = pymupdf.csGRAY if img["gray"] else pymupdf.csRGB
+    (width, height) = img["size"]
+    pixmap = pymupdf.Pixmap(
+        colorspace, width, height, img["samples"], int(img["alpha"])
+    )
+    return {"pixmap": pixmap}
+
+
+def img_sizeof(img):
+    return len(img["stream"]) if "stream" in img else len(img["samples"])
+
+
+# Converted images are kept across renders within a byte budget, keyed by path and
+# modification time so that recropped images are converted again, images are
+# prepared from several threads so every access holds the lock
+img_cache = LRUCache(CFG.RenderCacheMB * 1024 * 1024, img_sizeof)
+img_cache_lock = threading.Lock()
+
+# Images for upcoming pages are prepared by this many threads, at most
+# `prefetch_ahead` of them are held ready at a time
+prefetch_threads = min(os.cpu_count() or 1, 4)
+prefetch_ahead = 16
+
+
+# Returns an image ready to embed, fit into `max_size` pixels and re-encoded as
+# JPEG if `jpeg_quality` is given, safe to call from any thread
+def get_img(img_path, max_size=None, jpeg_quality=None):
+    # JPEG and PNG crops that need no changes are embedded straight from disk,
+    # JPEGs keep their DCT stream, everything else goes through pyvips
+    ext = os.path.splitext(img_path)[1].lower()
+    if ext in passthrough_image_extensions:
+        if jpeg_quality is None or ext in jpeg_image_extensions:
+            img = read_image(img_path)
+            if max_size is None or max(img.width, img.height) <= max_size:
+                with open(img_path, "rb") as fp:
+                    return {"stream": fp.read()}
+    return get_converted_img(img_path, max_size, jpeg_quality)
+
+
+def get_converted_img(img_path, max_size=None, jpeg_quality=None):
+    key = (img_path, os.stat(img_path).st_mtime_ns, max_size, jpeg_quality)
+    with img_cache_lock:
+        img = img_cache.get(key)
+    if img is None:
+        img = convert_img(img_path, max_size, jpeg_quality)
+        with img_cache_lock:
+            img_cache.put(key, img)
+    return img
+
+
+def convert_img(img_path, max_size, jpeg_quality):
+    img = read_image(img_path)
+    if max_size is not None and max(img.width, img.height) > max_size:
+        img = downscale_image(img_path, max_size)
+    if jpeg_quality is None:
+        return image_to_samples(img)
+    return {"stream": image_to_jpeg_bytes(img, jpeg_quality)}
+
+
+def get_page_layout(print_dict, size):
+    # Card size with bleed edge, bleed edge, page size and the card grid, in points
     bleed_edge = float(print_dict["bleed_edge"])
-    has_bleed_edge = bleed_edge > 0
-
-    def int_to_rgb(val):
-        return [
-            float((val >> 16) & 0xFF) / 0xFF,
-            float((val >> 8) & 0xFF) / 0xFF,
-            float((val >> 0) & 0xFF) / 0xFF,
-        ]
-
-    c1 = int_to_rgb(print_dict["guide_color_a"])
-    c2 = int_to_rgb(print_dict["guide_color_b"])
 
     b = 0
-    img_dir = crop_dir
-    if CFG.VibranceBump:
-        img_dir = os.path.join(img_dir, "vibrance")
-    if has_bleed_edge:
+    if bleed_edge > 0:
         b = mm_to_inch(bleed_edge)
-        img_dir = os.path.join(img_dir, str(bleed_edge).replace(".", "p"))
     (w, h) = card_size_without_bleed_inch
     w, h = inch_to_point((w + 2 * b)), inch_to_point((h + 2 * b))
     b = inch_to_point(b)
@@ -65,101 +192,648 @@ def generate(print_dict, crop_dir, size, pdf_path, print_fn):
     size = tuple(size[::-1]) if rotate else size
     pw, ph = size
     cols, rows = int(pw // w), int(ph // h)
-    rx, ry = round((pw - (w * cols)) / 2), round((ph - (h * rows)) / 2)
-
-    pdf_document = pymupdf.open()
+    return (w, h, b), (pw, ph), (cols, rows)
+
+
+def rank_page_layouts(print_dict):
+    # Every paper size in both orientations that fits the cards, fewest sheets first
+    # and then the least paper left around the cards
+    runs = get_card_runs(print_dict)
+    oversized_cards = sum(run[3] for run in runs if run[2])
+    single_cards = sum(run[3] for run in runs) + oversized_cards
+
+    layouts = []
+    for page_size, size in page_sizes.items():
+        for orient in ["Portrait", "Landscape"]:
+            layout_dict = dict(print_dict, pagesize=page_size, orient=orient)
+            ((w, h, _), (pw, ph), (cols, rows)) = get_page_layout(layout_dict, size)
+            if cols == 0 or rows == 0 or (oversized_cards > 0 and cols < 2):
+                continue
+
+            sheets = len(distribute_cards_to_pages(layout_dict, cols, rows))
+            paper_area = sheets * pw * ph
+            margin = 1 - single_cards * w * h / paper_area if sheets > 0 else 1
+            layouts.append(
+                {
+                    "pagesize": page_size,
+                    "orient": orient,
+                    "columns": cols,
+                    "rows": rows,
+                    "sheets": sheets,
+                    "margin": margin,
+                }
+            )
+
+    return sorted(layouts, key=lambda x: (x["sheets"], x["margin"]))
+
+
+def resolve_page_layout(print_dict):
+    # Replaces an "Auto" paper size with the best ranked paper size and orientation
+    if print_dict["pagesize"] != "Auto":
+        return print_dict
+
+    layouts = rank_page_layouts(print_dict)
+    if len(layouts) == 0:
+        return dict(print_dict, pagesize="Letter")
+    return dict(print_dict, pagesize=layouts[0]["pagesize"], orient=layouts[0]["orient"])
+
+
+def generate(print_dict, crop_dir, size, pdf_path, print_fn, jobs=1, chunk_pages=0):
+    bleed_edge = float(print_dict["bleed_edge"])
+    img_dir = crop_output_dir(crop_dir, bleed_edge, CFG.VibranceBump)
 
+    (_, _, (cols, rows)) = get_page_layout(print_dict, size)
     images = distribute_cards_to_pages(print_dict, cols, rows)
+    if print_dict["optimize_packing"]:
+        saved_pages = get_saved_pages(print_dict, cols, rows)
+        print_fn(f"Optimized packing saves {saved_pages} pages...")
 
-    enable_guides = print_dict["enable_guides"]
-    extended_guides = print_dict["extended_guides"]
-
-    @cache
-    def get_img(img_path, rotation):
-        img = read_image(img_path)
-        img = rotate_image(img, rotation)
-        img = image_to_bytes(img)
-        return pymupdf.Pixmap(io.BytesIO(img))
+    save_options = dict(output_profiles[print_dict["output_profile"]]["save_options"])
 
-    for p, page_images in enumerate(images):
-        render_fmt = "Rendering page {page}...\nImage number {img_idx} - {img_name}"
+    jobs = min(max(jobs or 1, 1), len(images))
+    if jobs > 1:
+        pdf_document = render_pages_parallel(
+            print_dict, img_dir, size, images, print_fn, jobs
+        )
 
-        page = pdf_document.new_page(width=pw, height=ph)
+        # Parts embed their own copies of shared images, merge identical streams
+        save_options["garbage"] = max(save_options.get("garbage", 0), 4)
+    elif chunk_pages > 0:
+        # Finished pages are written out every `chunk_pages` pages and the document
+        # is reopened from disk, so memory doesn't grow with the page count, object
+        # numbers have to stay the same between chunks so there is no garbage
+        # collection
+        save_options.pop("garbage", None)
+        saved_pages = 0
+
+        def flush(pdf_document):
+            nonlocal saved_pages
+            if pdf_document.page_count - saved_pages < chunk_pages:
+                return pdf_document
+
+            print_fn(f"Saving pages {saved_pages + 1} to {pdf_document.page_count}...")
+            saved_pages = pdf_document.page_count
+            save_pdf(pdf_document, pdf_path, save_options)
+            return pymupdf.open(pdf_path)
+
+        pdf_document = render_pages(
+            print_dict, img_dir, size, images, 0, print_fn, flush
+        )
+    else:
+        render_incremental(
+            print_dict, img_dir, size, images, pdf_path, print_fn, save_options
+        )
+        return
 
-        def draw_image(
-            img, oversized, i, x, y, dx=0.0, dy=0.0, is_short_edge=False, backside=False
-        ):
-            print_fn(render_fmt.format(page=p + 1, img_idx=i + 1, img_name=img))
+    print_fn("Saving PDF...")
+    save_pdf(pdf_document, pdf_path, save_options)
+
+
+def render_incremental(
+    print_dict, img_dir, size, images, pdf_path, print_fn, save_options
+):
+    # Pages are hashed from the render settings, their card grid and the contents of
+    # their images, pages of the previous render with a matching hash are kept
+    # as they are and only the others are rendered on top of the previous pdf
+    (_, _, (cols, rows)) = get_page_layout(print_dict, size)
+    page_keys = get_page_keys(print_dict, images, cols, rows)
+    settings = get_render_settings(print_dict, img_dir, size)
+
+    manifest = load_render_manifest(pdf_path)
+    if manifest is not None and manifest["settings"] != settings:
+        manifest = None
+
+    img_signatures = {}
+    for key in page_keys:
+        for img in get_page_key_images(key):
             img_path = os.path.join(img_dir, img)
-            if os.path.exists(img_path):
-                if oversized and backside:
-                    x = x - 1
-
-                rotation = get_card_rotation(backside, is_oversized, is_short_edge)
-                img = get_img(img_path, rotation)
-
-                x = rx + x * w + dx
-                y = ry + y * h + dy
-                cw = cw = 2 * w if oversized else w
-                ch = h
-
-                img_rect = pymupdf.Rect(x, y, x + cw, y + ch)
-                page.insert_image(img_rect, pixmap=img)
-
-        def draw_cross_at_grid(ix, iy, segment, dx=0.0, dy=0.0):
-            x = rx + ix * w + dx
-            y = ry + iy * h + dy
-            draw_cross(page, c1, c2, x, y, segment)
-            if extended_guides:
-                if ix == 0:
-                    draw_line(page, c1, c2, x, y, 0, y)
-                if ix == cols:
-                    draw_line(page, c1, c2, x, y, pw, y)
-                if iy == 0:
-                    draw_line(page, c1, c2, x, y, x, 0)
-                if iy == rows:
-                    draw_line(page, c1, c2, x, y, x, ph)
+            if img_path in img_signatures or not os.path.exists(img_path):
+                continue
+            previous_signature = manifest["images"].get(img_path) if manifest else None
+            img_signatures[img_path] = file_signature(img_path, previous_signature)
+
+    def get_page_hash(key):
+        img_hashes = [
+            img_signatures.get(os.path.join(img_dir, img), {}).get("hash")
+            for img in get_page_key_images(key)
+        ]
+        page = json.dumps([settings, key, img_hashes])
+        return hashlib.sha1(page.encode()).hexdigest()
+
+    page_hashes = [get_page_hash(key) for key in page_keys]
+
+    base = {
+        "document": None,
+        "img_xrefs": {},
+        "pages": {},
+    }
+    if manifest is not None:
+        try:
+            base["document"] = pymupdf.open(pdf_path)
+        except (RuntimeError, ValueError):
+            manifest = None
+
+    if manifest is not None:
+        previous_pages = {}
+        for i, page_hash in enumerate(manifest["pages"]):
+            previous_pages.setdefault(page_hash, i)
+        base["pages"] = {
+            key: previous_pages[page_hash]
+            for key, page_hash in zip(page_keys, page_hashes)
+            if page_hash in previous_pages
+        }
+
+        # Images that didn't change are still embedded in the previous pdf
+        base["img_xrefs"] = {
+            img_path: embedded_img
+            for img_path, embedded_img in get_embedded_imgs(
+                base["document"], img_dir
+            ).items()
+            if img_path in img_signatures
+            and manifest["images"].get(img_path) == img_signatures[img_path]
+        }
+
+        kept_pages = len(set(base["pages"].values()))
+        print_fn(f"Keeping {kept_pages} pages of the previous pdf...")
+
+        # Nothing to reuse, render from scratch rather than on top of the old pdf
+        if not base["pages"] and not base["img_xrefs"]:
+            base["document"].close()
+            base["document"] = None
+
+    pdf_document = render_pages(
+        print_dict, img_dir, size, images, 0, print_fn, base=base
+    )
 
-        card_grid = distribute_cards_to_grid(page_images, True, cols, rows)
+    print_fn("Saving PDF...")
+    if pdf_document.name:
+        merge_color_spaces(pdf_document)
+        # Still reading from the previous pdf, it can only be replaced once closed
+        pdf_document.save(f"{pdf_path}.tmp", **save_options)
+        pdf_document.close()
+        os.replace(f"{pdf_path}.tmp", pdf_path)
+    else:
+        save_pdf(pdf_document, pdf_path, save_options)
+
+    save_render_manifest(
+        pdf_path,
+        {
+            "settings": settings,
+            "pdf": file_signature(pdf_path),
+            "images": img_signatures,
+            "pages": page_hashes,
+        },
+    )
+
+
+def get_embedded_imgs(pdf_document, img_dir):
+    # Image path to its xref and the size it was fit into, None if not downscaled
+    embedded_imgs = {}
+    for xref in range(1, pdf_document.xref_length()):
+        (kind, img_name) = pdf_document.xref_get_key(xref, img_name_key)
+        if kind == "string":
+            (kind, max_size) = pdf_document.xref_get_key(xref, img_size_key)
+            max_size = int(max_size) if kind == "int" else None
+            embedded_imgs[os.path.join(img_dir, img_name)] = (xref, max_size)
+    return embedded_imgs
+
+
+def merge_color_spaces(pdf_document):
+    # Images embedded after reopening a pdf get their own copy of its colour profile,
+    # point them to the first identical one so that garbage collection drops the rest
+    color_spaces = {}
+    for xref in range(1, pdf_document.xref_length()):
+        (kind, color_space) = pdf_document.xref_get_key(xref, "ColorSpace")
+        (_, subtype) = pdf_document.xref_get_key(xref, "Subtype")
+        if kind != "xref" or subtype != "/Image":
+            continue
+
+        color_space_xref = int(color_space.split()[0])
+        definition = pdf_document.xref_object(color_space_xref, compressed=True)
+        if definition.startswith("[/ICCBased "):
+            profile_xref = int(definition.split()[1])
+            key = pdf_document.xref_stream(profile_xref)
+        else:
+            key = definition
+        pdf_document.xref_set_key(
+            xref, "ColorSpace", color_spaces.setdefault(key, color_space)
+        )
+
+
+def get_render_settings(print_dict, img_dir, size):
+    return {
+        "version": render_version,
+        "img_dir": img_dir,
+        "size": list(size),
+        "profile": output_profiles[print_dict["output_profile"]],
+        **{
+            key: print_dict[key]
+            for key in [
+                "orient",
+                "bleed_edge",
+                "backside_offset",
+                "enable_guides",
+                "extended_guides",
+                "guide_color_a",
+                "guide_color_b",
+            ]
+        },
+    }
+
+
+def render_manifest_path(pdf_path):
+    (pdf_dir, pdf_name) = os.path.split(pdf_path)
+    return os.path.join(pdf_dir, f".{pdf_name}.manifest.json")
+
+
+def load_render_manifest(pdf_path):
+    try:
+        with open(render_manifest_path(pdf_path), "r") as fp:
+            manifest = json.load(fp)
+    except (OSError, ValueError):
+        return None
+
+    # Only valid for exactly the pdf it was written with
+    if not os.path.exists(pdf_path):
+        return None
+    if file_signature(pdf_path, manifest["pdf"])["hash"] != manifest["pdf"]["hash"]:
+        return None
+    return manifest
+
+
+def save_render_manifest(pdf_path, manifest):
+    manifest_path = render_manifest_path(pdf_path)
+    with open(f"{manifest_path}.tmp", "w") as fp:
+        json.dump(manifest, fp)
+    os.replace(f"{manifest_path}.tmp", manifest_path)
+
+
+def save_pdf(pdf_document, pdf_path, save_options):
+    # Documents reopened from an earlier chunk only append their changes
+    if pdf_document.name:
+        pdf_document.save(
+            pdf_path,
+            incremental=True,
+            encryption=pymupdf.PDF_ENCRYPT_KEEP,
+            **save_options,
+        )
+    else:
+        pdf_document.save(pdf_path, **save_options)
+    pdf_document.close()
+
+
+def render_pages_parallel(print_dict, img_dir, size, images, print_fn, jobs):
+    # Every worker renders a contiguous run of pages into its own document, the
+    # parts are then appended in order, identical images are merged on save
+    chunk_size = -(-len(images) // jobs)
+    chunks = [
+        (first_page, images[first_page : first_page + chunk_size])
+        for first_page in range(0, len(images), chunk_size)
+    ]
+
+    print_fn(f"Rendering {len(images)} pages in {len(chunks)} jobs...")
+    with ProcessPoolExecutor(max_workers=len(chunks)) as executor:
+        parts = [
+            executor.submit(
+                render_pages_to_bytes, print_dict, img_dir, size, pages, first_page
+            )
+            for first_page, pages in chunks
+        ]
+
+        pdf_document = pymupdf.open()
+        for (first_page, pages), part in zip(chunks, parts):
+            part = pymupdf.open("pdf", part.result())
+            print_fn(
+                f"Merging pages {first_page + 1} to {first_page + len(pages)}..."
+            )
+            pdf_document.insert_pdf(part)
+            part.close()
+
+    return pdf_document
+
+
+def render_pages_to_bytes(print_dict, img_dir, size, pages, first_page):
+    pdf_document = render_pages(
+        print_dict, img_dir, size, pages, first_page, lambda *args: None
+    )
+    data = pdf_document.tobytes()
+    pdf_document.close()
+    return data
+
+
+def render_pages(
+    print_dict, img_dir, size, images, first_page, print_fn, flush=None, base=None
+):
+    has_backside = print_dict["backside_enabled"]
+    backside_offset = mm_to_point(float(print_dict["backside_offset"]))
+
+    def int_to_rgb(val):
+        return [
+            float((val >> 16) & 0xFF) / 0xFF,
+            float((val >> 8) & 0xFF) / 0xFF,
+            float((val >> 0) & 0xFF) / 0xFF,
+        ]
+
+    c1 = int_to_rgb(print_dict["guide_color_a"])
+    c2 = int_to_rgb(print_dict["guide_color_b"])
+
+    ((w, h, b), (pw, ph), (cols, rows)) = get_page_layout(print_dict, size)
+    rx, ry = round((pw - (w * cols)) / 2), round((ph - (h * rows)) / 2)
+
+    # A base document is rendered on top of, its pages listed in `base["pages"]`
+    # are reused by page key and its embedded images listed in `base["img_xrefs"]`
+    # by path
+    pdf_document = pymupdf.open()
+    base_pages = {}
+    if base is not None:
+        if base["document"] is not None:
+            pdf_document = base["document"]
+        base_pages = base["pages"]
+
+    enable_guides = print_dict["enable_guides"]
+    extended_guides = print_dict["extended_guides"]
 
-        i = 0
+    profile = output_profiles[print_dict["output_profile"]]
+    dpi = profile["dpi"]
+    jpeg_quality = profile["jpeg_quality"]
+
+    def get_max_size(cw, ch):
+        # Long side of the image in pixels at the profile's resolution
+        if dpi is None:
+            return None
+        return round(point_to_inch(max(cw, ch)) * dpi)
+
+    def insert_img(page, img_rect, img_path, rotate):
+        max_size = img_max_sizes[img_path]
+        img = get_insert_args(fetch_img(img_path, max_size))
+        try:
+            xref = page.insert_image(img_rect, **img, rotate=rotate)
+        except (RuntimeError, ValueError):
+            if "stream" not in img:
+                raise
+            # MuPDF could not parse the file itself, let pyvips decode it
+            img = get_insert_args(get_converted_img(img_path, max_size))
+            xref = page.insert_image(img_rect, **img, rotate=rotate)
+
+        img_name = pymupdf.get_pdf_str(os.path.basename(img_path))
+        pdf_document.xref_set_key(xref, img_name_key, img_name)
+        if max_size is not None:
+            pdf_document.xref_set_key(xref, img_size_key, str(max_size))
+        return xref
+
+    # Images the rendered pages place, in the order they place them, and the
+    # largest long side each is placed at, pages that are copied or reused from the
+    # base document place nothing
+    listed_imgs = []
+    img_max_sizes = {}
+    listed_keys = set(base_pages)
+    for page_images in images:
+        card_grid = distribute_cards_to_grid(page_images, True, cols, rows)
+        grids = [("front", card_grid)]
+        if has_backside:
+            grids.append(("backside", get_backside_grid(print_dict, card_grid)))
+
+        for side, grid in grids:
+            key = get_page_key(side, grid)
+            if key in listed_keys:
+                continue
+            listed_keys.add(key)
+
+            for card in (card for row in grid for card in row if card):
+                (img, _, oversized) = card
+                if img is None:
+                    continue
+                img_path = os.path.join(img_dir, img)
+                if not os.path.exists(img_path):
+                    continue
+                max_size = get_max_size(2 * w if oversized else w, h)
+                if img_path not in img_max_sizes:
+                    listed_imgs.append(img_path)
+                    img_max_sizes[img_path] = max_size
+                elif max_size is not None:
+                    img_max_sizes[img_path] = max(img_max_sizes[img_path], max_size)
+
+    # Every image is embedded only once, at its largest placement so that none of
+    # them falls below the profile's resolution, further placements reference its
+    # xref and rotation is part of the placement instead of the pixels, images of
+    # the base document are reused unless a placement now needs them larger
+    def is_large_enough(embedded_size, max_size):
+        if embedded_size is None:
+            return True
+        return max_size is not None and embedded_size >= max_size
+
+    img_xrefs = {}
+    if base is not None:
+        img_xrefs = {
+            img_path: xref
+            for img_path, (xref, embedded_size) in base["img_xrefs"].items()
+            if img_path not in img_max_sizes
+            or is_large_enough(embedded_size, img_max_sizes[img_path])
+        }
+
+    # Images that will be embedded, in the order pages place them
+    upcoming_imgs = deque(
+        (img_path, img_max_sizes[img_path])
+        for img_path in listed_imgs
+        if img_path not in img_xrefs
+    )
+
+    # A thread pool prepares upcoming images while pages are laid out here,
+    # `prefetch_stats` sums up how long that took and how long was waited on it
+    prefetch_executor = ThreadPoolExecutor(prefetch_threads)
+    prefetched_imgs = {}
+    prefetch_stats = {"count": 0, "prepare": 0.0, "wait": 0.0}
+
+    def prepare_img(img_path, max_size):
+        start = time.perf_counter()
+        img = get_img(img_path, max_size, jpeg_quality)
+        return (img, time.perf_counter() - start)
+
+    def fetch_img(img_path, max_size):
+        while upcoming_imgs and len(prefetched_imgs) < prefetch_ahead:
+            args = upcoming_imgs.popleft()
+            prefetched_imgs[args] = prefetch_executor.submit(prepare_img, *args)
+
+        future = prefetched_imgs.pop((img_path, max_size), None)
+        if future is None:
+            future = prefetch_executor.submit(prepare_img, img_path, max_size)
+
+        start = time.perf_counter()
+        (img, prepare_time) = future.result()
+        prefetch_stats["count"] += 1
+        prefetch_stats["prepare"] += prepare_time
+        prefetch_stats["wait"] += time.perf_counter() - start
+        return img
+
+    def draw_cross_at_grid(shape, ix, iy, segment, dx=0.0, dy=0.0):
+        x = rx + ix * w + dx
+        y = ry + iy * h + dy
+        draw_cross(shape, c1, c2, x, y, segment)
+        if extended_guides:
+            if ix == 0:
+                draw_line(shape, c1, c2, x, y, 0, y)
+            if ix == cols:
+                draw_line(shape, c1, c2, x, y, pw, y)
+            if iy == 0:
+                draw_line(shape, c1, c2, x, y, x, 0)
+            if iy == rows:
+                draw_line(shape, c1, c2, x, y, x, ph)
+
+    def draw_guides(page, card_grid):
+        shape = page.new_shape()
         for y in range(0, rows):
             for x in range(0, cols):
                 if card := card_grid[y][x]:
-                    (card_name, is_short_edge, is_oversized) = card
+                    (card_name, _, is_oversized) = card
                     if card_name is None:
                         continue
 
-                    draw_image(
-                        card_name, is_oversized, i, x, y, is_short_edge=is_short_edge
-                    )
-                    i = i + 1
-
-                    if not enable_guides:
-                        continue
-
                     if is_oversized:
                         ob = 2 * b
                         draw_cross_at_grid(
-                            x + 2, y + 0, CrossSegment.TopRight, -ob, +ob
+                            shape, x + 2, y + 0, CrossSegment.TopRight, -ob, +ob
                         )
                         draw_cross_at_grid(
-                            x + 2, y + 1, CrossSegment.BottomRight, -ob, -ob
+                            shape, x + 2, y + 1, CrossSegment.BottomRight, -ob, -ob
                         )
                     else:
                         ob = b
                         draw_cross_at_grid(
-                            x + 1, y + 0, CrossSegment.TopRight, -ob, +ob
+                            shape, x + 1, y + 0, CrossSegment.TopRight, -ob, +ob
                         )
                         draw_cross_at_grid(
-                            x + 1, y + 1, CrossSegment.BottomRight, -ob, -ob
+                            shape, x + 1, y + 1, CrossSegment.BottomRight, -ob, -ob
+                        )
+
+                    draw_cross_at_grid(shape, x, y + 0, CrossSegment.TopLeft, +ob, +ob)
+                    draw_cross_at_grid(
+                        shape, x, y + 1, CrossSegment.BottomLeft, +ob, -ob
+                    )
+        shape.commit()
+
+    # Guides only depend on which grid cells hold (oversized) cards, every distinct
+    # pattern is drawn once into its own document and shown on the first page that
+    # needs it, which embeds it as a form xobject that later pages draw again, its
+    # xref stays valid when chunks are saved and the document is reopened
+    guides_xrefs = {}
+
+    def show_guides(page, card_grid):
+        key = tuple(
+            tuple(card[2] if card and card[0] is not None else None for card in row)
+            for row in card_grid
+        )
+        if key in guides_xrefs:
+            show_form(page, guides_xrefs[key])
+        else:
+            guides_document = pymupdf.open()
+            draw_guides(guides_document.new_page(width=pw, height=ph), card_grid)
+            guides_xrefs[key] = page.show_pdf_page(page.rect, guides_document)
+            guides_document.close()
+
+    # Pages showing the same cards in the same spots are copied instead of drawn,
+    # `page_order` holds the final order when rendering on top of a base document
+    page_numbers = {}
+    page_order = []
+
+    def copy_page(key, page_fmt, p):
+        if key in page_numbers:
+            print_fn(page_fmt.format(page=first_page + p + 1))
+            page_order.append(pdf_document.page_count)
+            pdf_document.fullcopy_page(page_numbers[key])
+            return True
+
+        if key in base_pages:
+            print_fn(page_fmt.format(page=first_page + p + 1))
+            page_numbers[key] = base_pages[key]
+            page_order.append(base_pages[key])
+            return True
+
+        page_numbers[key] = pdf_document.page_count
+        page_order.append(pdf_document.page_count)
+        return False
+
+    try:
+        for p, page_images in enumerate(images):
+            if flush is not None:
+                pdf_document = flush(pdf_document)
+
+            render_fmt = "Rendering page {page}...\nImage number {img_idx} - {img_name}"
+
+            def draw_image(
+                img,
+                oversized,
+                i,
+                x,
+                y,
+                dx=0.0,
+                dy=0.0,
+                is_short_edge=False,
+                backside=False,
+            ):
+                print_fn(
+                    render_fmt.format(
+                        page=first_page + p + 1, img_idx=i + 1, img_name=img
+                    )
+                )
+                img_path = os.path.join(img_dir, img)
+                if os.path.exists(img_path):
+                    if oversized and backside:
+                        x = x - 1
+
+                    rotation = get_card_rotation(backside, is_oversized, is_short_edge)
+                    rotate = get_rotation_degrees(rotation)
+
+                    x = rx + x * w + dx
+                    y = ry + y * h + dy
+                    cw = cw = 2 * w if oversized else w
+                    ch = h
+
+                    img_rect = pymupdf.Rect(x, y, x + cw, y + ch)
+                    if img_path in img_xrefs:
+                        page.insert_image(
+                            img_rect, xref=img_xrefs[img_path], rotate=rotate
+                        )
+                    else:
+                        img_xrefs[img_path] = insert_img(
+                            page, img_rect, img_path, rotate
                         )
 
-                    draw_cross_at_grid(x, y + 0, CrossSegment.TopLeft, +ob, +ob)
-                    draw_cross_at_grid(x, y + 1, CrossSegment.BottomLeft, +ob, -ob)
+            card_grid = distribute_cards_to_grid(page_images, True, cols, rows)
+
+            front_key = get_page_key("front", card_grid)
+            if not copy_page(front_key, "Copying page {page}...", p):
+                page = pdf_document.new_page(width=pw, height=ph)
+
+                i = 0
+                for y in range(0, rows):
+                    for x in range(0, cols):
+                        if card := card_grid[y][x]:
+                            (card_name, is_short_edge, is_oversized) = card
+                            if card_name is None:
+                                continue
+
+                            draw_image(
+                                card_name,
+                                is_oversized,
+                                i,
+                                x,
+                                y,
+                                is_short_edge=is_short_edge,
+                            )
+                            i = i + 1
+
+                if enable_guides:
+                    show_guides(page, card_grid)
+
+            # Draw back-sides if requested
+            if not has_backside:
+                continue
+
+            backside_grid = get_backside_grid(print_dict, card_grid)
+            backside_key = get_page_key("backside", backside_grid)
+            if copy_page(backside_key, "Copying backside for page {page}...", p):
+                continue
 
-        # Draw back-sides if requested
-        if has_backside:
             render_fmt = "Rendering backside for page {page}...\nImage number {img_idx} - {img_name}"
 
             page = pdf_document.new_page(width=pw, height=ph)
@@ -167,21 +841,18 @@ def generate(print_dict, crop_dir, size, pdf_path, print_fn):
             i = 0
             for y in range(0, rows):
                 for x in range(0, cols):
-                    if card := card_grid[y][x]:
-                        (card_name, is_short_edge, is_oversized) = card
-                        if card_name is None:
+                    if card := backside_grid[y][x]:
+                        (backside, is_short_edge, is_oversized) = card
+                        if backside is None:
                             continue
 
                         print_fn(
                             render_fmt.format(
-                                page=p + 1, img_idx=i + 1, img_name=card_name
+                                page=first_page + p + 1,
+                                img_idx=i + 1,
+                                img_name=card_grid[y][x][0],
                             )
                         )
-                        backside = (
-                            print_dict["backsides"][card_name]
-                            if card_name in print_dict["backsides"]
-                            else print_dict["backside_default"]
-                        )
                         draw_image(
                             backside,
                             is_oversized,
@@ -192,74 +863,223 @@ def generate(print_dict, crop_dir, size, pdf_path, print_fn):
                             is_short_edge=is_short_edge,
                             backside=True,
                         )
+    finally:
+        # Also stops the prefetch threads when rendering fails or is interrupted
+        prefetch_executor.shutdown(cancel_futures=True)
+
+    if prefetch_stats["count"] > 0:
+        prepare_time = prefetch_stats["prepare"]
+        hidden_time = max(prepare_time - prefetch_stats["wait"], 0.0)
+        print_fn(
+            f"Prepared {prefetch_stats['count']} images in {prepare_time:.2f}s, "
+            f"{hidden_time:.2f}s of it overlapped with page layout"
+        )
+
+    if page_order != list(range(pdf_document.page_count)):
+        pdf_document.select(page_order)
+    return pdf_document
+
+
+def get_backside(print_dict, card_name):
+    return (
+        print_dict["backsides"][card_name]
+        if card_name in print_dict["backsides"]
+        else print_dict["backside_default"]
+    )
+
+
+def get_backside_grid(print_dict, card_grid):
+    return [
+        [
+            (get_backside(print_dict, card[0]), *card[1:]) if card and card[0] else card
+            for card in row
+        ]
+        for row in card_grid
+    ]
+
+
+# Pages showing the same cards in the same spots are identical, backside pages are
+# keyed by the backside of every card
+def get_page_key(side, card_grid):
+    return (side, tuple(map(tuple, card_grid)))
+
+
+def get_page_keys(print_dict, images, cols, rows):
+    page_keys = []
+    for page_images in images:
+        card_grid = distribute_cards_to_grid(page_images, True, cols, rows)
+        page_keys.append(get_page_key("front", card_grid))
+        if print_dict["backside_enabled"]:
+            backside_grid = get_backside_grid(print_dict, card_grid)
+            page_keys.append(get_page_key("backside", backside_grid))
+    return page_keys
 
-    print_fn("Saving PDF...")
-    pdf_document.save(pdf_path)
-    pdf_document.close()
+
+def get_page_key_images(key):
+    (_, card_grid) = key
+    return [card[0] for row in card_grid for card in row if card and card[0]]
 
 
 def distribute_cards_to_pages(print_dict, columns, rows):
-    images_per_page = columns * rows
-    oversized_images_per_page = (columns // 2) * rows
+    if print_dict["optimize_packing"]:
+        return distribute_cards_to_fewest_pages(print_dict, columns, rows)
+    return distribute_cards_first_fit(print_dict, columns, rows)
+
 
+def get_card_runs(print_dict):
     short_edge_dict = print_dict["backside_short_edge"]
     oversized_dict = print_dict["oversized"] if print_dict["oversized_enabled"] else {}
 
-    # throw all images n times into a list
-    images = []
+    # one run per card instead of a list entry per copy
+    runs = []
     for img, num in print_dict["cards"].items():
         is_short_edge = short_edge_dict[img] if img in short_edge_dict else False
         is_oversized = oversized_dict[img] if img in oversized_dict else False
-        images.extend([(img, is_short_edge, is_oversized)] * num)
+        if num > 0:
+            runs.append((img, is_short_edge, is_oversized, num))
 
     # favor filling up with oversized cards first
-    images = sorted(images, key=lambda x: not x[1])
+    return sorted(runs, key=lambda x: not x[1])
+
+
+def distribute_cards_first_fit(print_dict, columns, rows):
+    images_per_page = columns * rows
+    oversized_images_per_page = (columns // 2) * rows
 
-    def page_has_space(page, oversized):
+    runs = get_card_runs(print_dict)
+
+    def get_free_spaces(page):
         oversized_cards = len(page["oversized"])
         regular_cards = len(page["regular"])
         single_spaces = regular_cards + oversized_cards * 2
         free_single_spaces = images_per_page - single_spaces
+        free_double_spaces = oversized_images_per_page - oversized_cards
+        return (free_single_spaces, free_double_spaces)
+
+    def get_page_space(page, oversized):
+        # number of cards of a kind that still fit on the page
+        (free_single_spaces, free_double_spaces) = get_free_spaces(page)
         if oversized:
-            free_double_spaces = oversized_images_per_page - oversized_cards
-            return free_double_spaces > 0 and free_single_spaces > 1
+            return max(min(free_double_spaces, free_single_spaces // 2), 0)
         else:
-            return free_single_spaces > 0
+            return max(free_single_spaces, 0)
 
-    def is_page_full(page):
-        return page_has_space(page, False) == False
-
-    empty_page = {"regular": [], "oversized": []}
     pages = []
 
-    unfinished_pages = []
-    for img, is_short_edge, is_oversized in images:
-        # get a page that can fit this card
-        page_with_space = next(
-            filter(lambda x: page_has_space(x, is_oversized), unfinished_pages),
-            None,
-        )
-
-        # or start a new page if none is available
-        if page_with_space is None:
-            unfinished_pages.append(deepcopy(empty_page))
-            page_with_space = unfinished_pages[-1]
+    # pages that are not full yet in the order they were started, every copy goes
+    # to the first of them that fits it, regular cards fit on all of them and
+    # pages that can't fit an oversized card never will again
+    unfinished_pages = {}
+    oversized_candidates = deque()
+    page_count = 0
+
+    def fits_oversized(page_idx):
+        if page_idx not in unfinished_pages:
+            return False
+        return get_page_space(unfinished_pages[page_idx], True) > 0
+
+    for img, is_short_edge, is_oversized, num in runs:
+        while num > 0:
+            # get a page that can fit this card
+            if is_oversized:
+                while oversized_candidates and not fits_oversized(
+                    oversized_candidates[0]
+                ):
+                    oversized_candidates.popleft()
+                page_idx = oversized_candidates[0] if oversized_candidates else None
+            else:
+                page_idx = next(iter(unfinished_pages), None)
+
+            # or start a new page if none is available, it takes at least one card
+            if page_idx is None:
+                page_idx = page_count
+                page_count = page_count + 1
+                unfinished_pages[page_idx] = {"regular": [], "oversized": []}
+                oversized_candidates.append(page_idx)
+                page = unfinished_pages[page_idx]
+                cards = max(min(num, get_page_space(page, is_oversized)), 1)
+            else:
+                page = unfinished_pages[page_idx]
+                cards = min(num, get_page_space(page, is_oversized))
 
-        # add the image to the page
-        page_with_space["oversized" if is_oversized else "regular"].append(
-            (img, is_short_edge)
-        )
+            # add the images to the page
+            page["oversized" if is_oversized else "regular"].extend(
+                [(img, is_short_edge)] * cards
+            )
+            num = num - cards
 
-        # push full page into final list
-        if is_page_full(page_with_space):
-            pages.append(page_with_space)
-            unfinished_pages.remove(page_with_space)
+            # push full page into final list
+            if get_free_spaces(page)[0] <= 0:
+                pages.append(unfinished_pages.pop(page_idx))
 
     # push all unfinished pages into final list
-    pages.extend(unfinished_pages)
+    pages.extend(unfinished_pages.values())
+    return pages
+
+
+def get_min_page_count(oversized_cards, regular_cards, columns, rows):
+    # A page fits any mix of cards that leaves an oversized card at most every
+    # second column and doesn't exceed its spaces, see `distribute_cards_to_grid`
+    images_per_page = columns * rows
+    oversized_images_per_page = (columns // 2) * rows
+
+    single_spaces = oversized_cards * 2 + regular_cards
+    page_count = -(-single_spaces // images_per_page)
+    if oversized_cards > 0:
+        page_count = max(page_count, -(-oversized_cards // oversized_images_per_page))
+    return page_count
+
+
+def distribute_cards_to_fewest_pages(print_dict, columns, rows):
+    images_per_page = columns * rows
+    oversized_images_per_page = (columns // 2) * rows
+
+    runs = get_card_runs(print_dict)
+    oversized_runs = [run for run in runs if run[2]]
+    regular_runs = [run for run in runs if not run[2]]
+
+    oversized_cards = sum(run[3] for run in oversized_runs)
+    regular_cards = sum(run[3] for run in regular_runs)
+    if images_per_page == 0 or (oversized_cards > 0 and oversized_images_per_page == 0):
+        # oversized cards don't fit this grid at all, nothing to optimize
+        return distribute_cards_first_fit(print_dict, columns, rows)
+
+    page_count = get_min_page_count(oversized_cards, regular_cards, columns, rows)
+    pages = [{"regular": [], "oversized": []} for _ in range(page_count)]
+
+    # oversized cards fill pages front to back, then regular cards fill the spaces
+    # left, that always fits into `page_count` pages
+    def fill_pages(runs, kind, get_page_space):
+        p = 0
+        for img, is_short_edge, _, num in runs:
+            while num > 0:
+                cards = min(num, get_page_space(pages[p]))
+                pages[p][kind].extend([(img, is_short_edge)] * cards)
+                num = num - cards
+                if num > 0:
+                    p = p + 1
+
+    fill_pages(
+        oversized_runs,
+        "oversized",
+        lambda page: oversized_images_per_page - len(page["oversized"]),
+    )
+    fill_pages(
+        regular_runs,
+        "regular",
+        lambda page: images_per_page
+        - len(page["regular"])
+        - len(page["oversized"]) * 2,
+    )
     return pages
 
 
+def get_saved_pages(print_dict, columns, rows):
+    first_fit_pages = distribute_cards_first_fit(print_dict, columns, rows)
+    fewest_pages = distribute_cards_to_fewest_pages(print_dict, columns, rows)
+    return len(first_fit_pages) - len(fewest_pages)
+
+
 def make_backside_pages(print_dict, pages):
     back_dict = print_dict["backsides"]
 
@@ -334,3 +1154,15 @@ def get_card_rotation(backside, is_oversized, is_short_edge):
         return Rotation.RotateClockwise_90
 
     return None
+
+
+# PyMuPDF rotates images counter-clockwise for positive angles
+def get_rotation_degrees(rotation):
+    match rotation:
+        case Rotation.RotateClockwise_90:
+            return -90
+        case Rotation.RotateCounterClockwise_90:
+            return 90
+        case Rotation.Rotate_180:
+            return 180
+    return 0
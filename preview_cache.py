@@ -0,0 +1,260 @@
+import os
+import ast
+import json
+import sqlite3
+import threading
+from collections.abc import Mapping, MutableMapping
+
+# Previews are stored as raw encoded images in an sqlite database, one row per
+# card and preview kind, older caches stored `str(bytes)` reprs in a json file
+cache_format_version = 1
+preview_kinds = ["data", "thumb", "uncropped"]
+
+
+def is_sqlite_file(path):
+    with open(path, "rb") as fp:
+        return fp.read(16) == b"SQLite format 3\x00"
+
+
+def connect(path):
+    # `PreviewCache` shares the connection across threads behind its lock
+    db = sqlite3.connect(path, check_same_thread=False)
+    db.execute("PRAGMA mmap_size = 268435456")
+
+    # Reading the version doesn't write, the schema is only set up for a new file
+    (version,) = db.execute("PRAGMA user_version").fetchone()
+    if version != cache_format_version:
+        db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS previews (
+                name TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                width NUMERIC NOT NULL,
+                height NUMERIC NOT NULL,
+                data BLOB NOT NULL,
+                PRIMARY KEY (name, kind)
+            ) WITHOUT ROWID
+            """
+        )
+        db.execute(f"PRAGMA user_version = {cache_format_version}")
+        db.commit()
+    return db
+
+
+def entry_to_rows(name, entry):
+    for kind in preview_kinds:
+        preview = entry if kind == "data" else entry.get(kind)
+        if preview is None or "data" not in preview:
+            continue
+        (width, height) = preview["size"]
+        yield (name, kind, width, height, preview["data"])
+
+
+def migrate_json_cache(path):
+    with open(path, "r") as fp:
+        json_data = json.load(fp)
+
+    def to_bytes(data):
+        return ast.literal_eval(data) if isinstance(data, str) else data
+
+    data = {}
+    for name, json_entry in json_data.items():
+        entry = {}
+        for kind in preview_kinds:
+            json_preview = json_entry if kind == "data" else json_entry.get(kind)
+            if json_preview is None or "data" not in json_preview:
+                continue
+            preview = {
+                "data": to_bytes(json_preview["data"]),
+                "size": json_preview["size"],
+            }
+            if kind == "data":
+                entry.update(preview)
+            else:
+                entry[kind] = preview
+        data[name] = entry
+
+    save(path, data)
+    return data
+
+
+def open_db(path):
+    # Returns None while there is no cache file yet, it is created on first update
+    if not os.path.exists(path):
+        return None
+
+    if not is_sqlite_file(path):
+        try:
+            migrate_json_cache(path)
+        except (OSError, ValueError, SyntaxError):
+            os.remove(path)
+            return None
+    return connect(path)
+
+
+def load_index(db):
+    index = {}
+    rows = db.execute("SELECT name, kind, width, height FROM previews")
+    for name, kind, width, height in rows:
+        index.setdefault(name, {})[kind] = [width, height]
+    return index
+
+
+def entry_kinds(entry):
+    return {
+        kind: [width, height] for _, kind, width, height, _ in entry_to_rows(None, entry)
+    }
+
+
+def get(db, name, kind):
+    row = db.execute(
+        "SELECT data FROM previews WHERE name = ? AND kind = ?",
+        (name, kind),
+    ).fetchone()
+    return bytes(row[0]) if row is not None else None
+
+
+def update(db, data, changed, deleted=()):
+    # Only touches rows of the given cards, all in one transaction
+    changed = [name for name in changed if name in data]
+    with db:
+        db.executemany(
+            "DELETE FROM previews WHERE name = ?",
+            ((name,) for name in [*deleted, *changed]),
+        )
+        db.executemany(
+            "INSERT INTO previews VALUES (?, ?, ?, ?, ?)",
+            (row for name in changed for row in entry_to_rows(name, data[name])),
+        )
+
+
+def save(path, data):
+    # Write to a fresh database and swap it in, so a crash keeps the old cache
+    tmp_path = f"{path}.tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+
+    with connect(tmp_path) as db:
+        db.executemany(
+            "INSERT INTO previews VALUES (?, ?, ?, ?, ?)",
+            (row for name, entry in data.items() for row in entry_to_rows(name, entry)),
+        )
+    db.close()
+    os.replace(tmp_path, path)
+
+
+class PreviewEntry(Mapping):
+    """A card's previews as returned by `PreviewCache`, the image data of each
+    preview kind is only loaded once that kind is accessed."""
+
+    def __init__(self, cache, name):
+        self._cache = cache
+        self._name = name
+
+    def _kinds(self):
+        return self._cache._index.get(self._name, {})
+
+    def __getitem__(self, key):
+        kinds = self._kinds()
+        if key == "size" and "data" in kinds:
+            return kinds["data"]
+        if key not in kinds:
+            raise KeyError(key)
+
+        data = self._cache._load(self._name, key)
+        if key == "data":
+            return data
+        return {"data": data, "size": kinds[key]}
+
+    def __contains__(self, key):
+        kinds = self._kinds()
+        return key in kinds or (key == "size" and "data" in kinds)
+
+    def __iter__(self):
+        kinds = self._kinds()
+        for kind in preview_kinds:
+            if kind in kinds:
+                yield kind
+                if kind == "data":
+                    yield "size"
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+
+class PreviewCache(MutableMapping):
+    """Card name to preview mapping backed by a cache file, only names and preview
+    sizes are read upfront. The image data of a preview kind is loaded on first
+    access and kept for as long as the file is open, so refreshes don't read it
+    again. The file stays open until another one is opened or `close` is called."""
+
+    def __init__(self):
+        self._path = None
+        self._db = None
+        # The cropper updates the cache from a worker thread
+        self._lock = threading.Lock()
+        self._index = {}
+        self._loaded = {}
+
+    def open(self, path):
+        self.close()
+        self._path = path
+        with self._lock:
+            self._db = open_db(path)
+            self._index = load_index(self._db) if self._db is not None else {}
+            self._loaded.clear()
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def kinds(self, name):
+        return self._index.get(name, {}).keys()
+
+    def update_entries(self, changed, deleted=()):
+        with self._lock:
+            if self._db is None:
+                self._db = connect(self._path)
+            update(self._db, changed, changed.keys(), deleted)
+            # Changed previews are loaded again once they are accessed
+            for name in [*deleted, *changed]:
+                for kind in preview_kinds:
+                    self._loaded.pop((name, kind), None)
+            for name in deleted:
+                self._index.pop(name, None)
+            for name, entry in changed.items():
+                self._index[name] = entry_kinds(entry)
+
+    def _load(self, name, kind):
+        with self._lock:
+            data = self._loaded.get((name, kind))
+            if data is None:
+                data = get(self._db, name, kind)
+                if data is None:
+                    raise KeyError(kind)
+                self._loaded[(name, kind)] = data
+            return data
+
+    def __getitem__(self, name):
+        if name not in self._index:
+            raise KeyError(name)
+        return PreviewEntry(self, name)
+
+    def __setitem__(self, name, entry):
+        self.update_entries({name: entry})
+
+    def __delitem__(self, name):
+        if name not in self._index:
+            raise KeyError(name)
+        self.update_entries({}, [name])
+
+    def __contains__(self, name):
+        return name in self._index
+
+    def __iter__(self):
+        return iter(list(self._index.keys()))
+
+    def __len__(self):
+        return len(self._index)
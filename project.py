@@ -35,6 +35,8 @@ def init_dict(print_dict, img_dict):
         "guide_color_b": 0x000000,
         "orient": "Portrait",
         "bleed_edge": "0",
+        "output_profile": "Archive",
+        "optimize_packing": False,
         "filename": "_printme",
     }
 
@@ -92,40 +94,34 @@ def init_dict(print_dict, img_dict):
             0 if img.startswith("__") else print_dict["cards"][img]
         )
 
-    # Initialize image cache
-    img_cache = print_dict["img_cache"]
-    if os.path.exists(img_cache):
-        with open(img_cache, "r") as fp:
-            loaded_img_dict = json.load(fp)
-            img_dict.clear()
-            for key, value in loaded_img_dict.items():
-                img_dict[key] = value
+    # Initialize image cache, previews themselves are only loaded once needed
+    img_dict.open(print_dict["img_cache"])
 
 
 def init_images(print_dict, img_dict, print_fn):
     image_dir = print_dict["image_dir"]
     crop_dir = os.path.join(image_dir, "crop")
-    img_cache = print_dict["img_cache"]
 
     # setup crops
     bleed_edge = float(print_dict["bleed_edge"])
-    if image.need_run_cropper(image_dir, crop_dir, bleed_edge, CFG.VibranceBump):
+    if image.need_run_cropper(
+        image_dir, crop_dir, bleed_edge, CFG.MaxDPI, CFG.VibranceBump
+    ):
         image.cropper(
             image_dir,
             crop_dir,
-            img_cache,
             img_dict,
             bleed_edge,
             CFG.MaxDPI,
             CFG.VibranceBump,
             CFG.EnableUncrop,
             print_fn,
+            CFG.CropperJobs,
         )
 
     # setup image previews
-    img_cache = print_dict["img_cache"]
     if image.need_cache_previews(crop_dir, img_dict):
-        image.cache_previews(img_cache, image_dir, crop_dir, print_fn, img_dict)
+        image.cache_previews(image_dir, crop_dir, print_fn, img_dict)
 
 
 def load(print_dict, img_dict, json_path, print_fn):
@@ -0,0 +1,8 @@
+import os
+import sys
+
+# Modules are imported from the repository root and, like the app, find config.ini
+# and their resources relative to the working directory
+repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, repo_dir)
+os.chdir(repo_dir)
@@ -0,0 +1,52 @@
+import pyvips
+import pytest
+from PIL import Image as PIL_Image
+
+import image
+
+
+def make_card(bands, width=300, height=420):
+    noise = pyvips.Image.gaussnoise(width, height, mean=128, sigma=80)
+    card = noise.bandjoin([noise.rot180(), noise.flip("horizontal")])
+    if bands == 4:
+        card = card.bandjoin(noise.flip("vertical"))
+    return card.cast("uchar").copy(interpretation="srgb")
+
+
+def old_vibrance_bump(img):
+    # The cropper's path before vibrance_bump, kept as reference
+    return pyvips.Image.new_from_array(
+        PIL_Image.fromarray(img.numpy()).filter(image.get_vibrance_cube())
+    )
+
+
+@pytest.mark.parametrize("bands", [3, 4])
+def test_vibrance_bump_matches_numpy_path(bands):
+    card = make_card(bands)
+    expected = old_vibrance_bump(card)
+    result = image.vibrance_bump(card)
+
+    assert result.bands == expected.bands == bands
+    assert result.format == "uchar"
+    assert result.interpretation == "srgb"
+    assert result.write_to_memory() == expected.write_to_memory()
+
+
+def test_vibrance_bump_keeps_gif_alpha(tmp_path):
+    # The old path tagged its output as multiband, which broke the alpha channel of
+    # GIF crops once written, the new output is sRGB and keeps it
+    card = make_card(4)
+    alpha = (pyvips.Image.black(card.width, card.height) + 255).cast("uchar")
+    alpha = alpha.draw_rect(0, 0, 0, 40, 40, fill=True)
+    card = card.extract_band(0, n=3).bandjoin(alpha)
+
+    gif_path = tmp_path / "card.gif"
+    card.write_to_file(str(gif_path))
+    gif = pyvips.Image.new_from_file(str(gif_path))
+
+    out_path = tmp_path / "vibrance.gif"
+    image.vibrance_bump(gif).write_to_file(str(out_path))
+    out = pyvips.Image.new_from_file(str(out_path))
+
+    assert out.bands == 4
+    assert out.extract_band(3).avg() == pytest.approx(gif.extract_band(3).avg())
@@ -0,0 +1,106 @@
+import random
+from functools import cache
+
+import pytest
+
+import pdf
+from benchmarks.bench_packing import distribute_cards_per_copy
+
+
+def make_print_dict(rng, card_count, max_copies):
+    cards = {f"card{i}.png": rng.randint(0, max_copies) for i in range(card_count)}
+    return {
+        "cards": cards,
+        "backside_short_edge": {
+            card: rng.random() < 0.3 for card in cards if rng.random() < 0.7
+        },
+        "oversized_enabled": rng.random() < 0.8,
+        "oversized": {card: rng.random() < 0.4 for card in cards if rng.random() < 0.7},
+        "optimize_packing": False,
+    }
+
+
+def random_layouts(seed, count):
+    rng = random.Random(seed)
+    for _ in range(count):
+        print_dict = make_print_dict(rng, rng.randint(0, 8), rng.choice([1, 3, 10, 25]))
+        yield (print_dict, rng.randint(1, 5), rng.randint(1, 4))
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_first_fit_matches_per_copy_packer(seed):
+    for print_dict, columns, rows in random_layouts(seed, 400):
+        expected = distribute_cards_per_copy(print_dict, columns, rows)
+        assert pdf.distribute_cards_first_fit(print_dict, columns, rows) == expected
+        assert pdf.distribute_cards_to_pages(print_dict, columns, rows) == expected
+
+
+def grid_accepts(page, columns, rows):
+    # `distribute_cards_to_grid` runs off the grid when a page doesn't fit its cards
+    for left_to_right in (True, False):
+        try:
+            pdf.distribute_cards_to_grid(page, left_to_right, columns, rows)
+        except IndexError:
+            return False
+    return True
+
+
+@cache
+def brute_force_min_page_count(oversized_cards, regular_cards, columns, rows):
+    # Tries every way to split the cards into pages the grid accepts
+    mixes = [
+        (o, r)
+        for o in range(oversized_cards + 1)
+        for r in range(regular_cards + 1)
+        if (o or r)
+        and grid_accepts(
+            {"oversized": [("", False)] * o, "regular": [("", False)] * r},
+            columns,
+            rows,
+        )
+    ]
+
+    @cache
+    def min_page_count(o, r):
+        if o == 0 and r == 0:
+            return 0
+        page_counts = [
+            1 + min_page_count(o - mo, r - mr)
+            for mo, mr in mixes
+            if mo <= o and mr <= r
+        ]
+        return min(page_counts, default=float("inf"))
+
+    return min_page_count(oversized_cards, regular_cards)
+
+
+def count_copies(pages):
+    copies = {}
+    for page in pages:
+        for img, _ in page["oversized"] + page["regular"]:
+            copies[img] = copies.get(img, 0) + 1
+    return copies
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_fewest_pages_is_minimal(seed):
+    rng = random.Random(seed)
+    for _ in range(200):
+        print_dict = make_print_dict(rng, rng.randint(1, 5), 6)
+        print_dict["optimize_packing"] = True
+        (columns, rows) = (rng.randint(2, 5), rng.randint(1, 3))
+
+        pages = pdf.distribute_cards_to_fewest_pages(print_dict, columns, rows)
+        assert pages == pdf.distribute_cards_to_pages(print_dict, columns, rows)
+        for page in pages:
+            assert grid_accepts(page, columns, rows)
+        assert count_copies(pages) == {
+            img: num for img, num in print_dict["cards"].items() if num > 0
+        }
+
+        runs = pdf.get_card_runs(print_dict)
+        oversized_cards = sum(run[3] for run in runs if run[2])
+        regular_cards = sum(run[3] for run in runs if not run[2])
+        assert len(pages) == brute_force_min_page_count(
+            oversized_cards, regular_cards, columns, rows
+        )
@@ -0,0 +1,170 @@
+from pathlib import Path
+
+import pyvips
+import pymupdf
+import pytest
+
+import pdf
+from constants import page_sizes
+
+
+def make_print_dict(cards, **options):
+    print_dict = {
+        "cards": cards,
+        "backside_enabled": False,
+        "backside_default": "__back.png",
+        "backside_offset": "0",
+        "backsides": {},
+        "backside_short_edge": {},
+        "oversized_enabled": False,
+        "oversized": {},
+        "pagesize": "Letter",
+        "enable_guides": True,
+        "extended_guides": True,
+        "guide_color_a": 0xBFBFBF,
+        "guide_color_b": 0x000000,
+        "orient": "Portrait",
+        "bleed_edge": "0",
+        "output_profile": "Archive",
+        "optimize_packing": False,
+        "filename": "_printme",
+    }
+    print_dict.update(options)
+    return print_dict
+
+
+def write_cards(img_dir, names):
+    img_dir.mkdir(parents=True, exist_ok=True)
+    for i, name in enumerate(names):
+        if (img_dir / name).exists():
+            continue
+        card = pyvips.Image.gaussnoise(64, 88, mean=40 + i * 20, sigma=30)
+        card = card.bandjoin([card.rot180(), card.flip("horizontal")]).cast("uchar")
+        card.write_to_file(str(img_dir / name))
+
+
+@pytest.fixture
+def crop_dir(tmp_path):
+    crop_dir = tmp_path / "images" / "crop"
+    crop_dir.mkdir(parents=True)
+    return crop_dir
+
+
+def render(print_dict, crop_dir, pdf_path, **kwargs):
+    img_dir = pdf.crop_output_dir(
+        str(crop_dir), float(print_dict["bleed_edge"]), pdf.CFG.VibranceBump
+    )
+    write_cards(Path(img_dir), [*print_dict["cards"], print_dict["backside_default"]])
+    pdf.generate(
+        print_dict,
+        str(crop_dir),
+        page_sizes[print_dict["pagesize"]],
+        str(pdf_path),
+        lambda *args: None,
+        **kwargs,
+    )
+    return pymupdf.open(str(pdf_path))
+
+
+def image_xrefs(document):
+    return {img[0] for page in document for img in page.get_images()}
+
+
+@pytest.mark.parametrize("options", [{}, {"jobs": 2}, {"chunk_pages": 2}])
+def test_repeated_cards_embed_each_image_once(crop_dir, tmp_path, options):
+    print_dict = make_print_dict(
+        {"a.png": 7, "b.jpg": 5, "c.png": 12, "d.png": 1},
+        backside_enabled=True,
+        backsides={"b.jpg": "d.png"},
+        oversized_enabled=True,
+        oversized={"c.png": True},
+    )
+    document = render(print_dict, crop_dir, tmp_path / "out.pdf", **options)
+
+    # four cards and the default backside, d.png is both a card and a backside
+    assert document.page_count > 4
+    assert len(image_xrefs(document)) == 5
+
+
+def form_xrefs(document):
+    return {
+        xref
+        for xref in range(1, document.xref_length())
+        if document.xref_get_key(xref, "Subtype") == ("name", "/Form")
+    }
+
+
+def test_chunked_render_shares_guide_forms(crop_dir, tmp_path):
+    cards = {f"card{i}.png": i % 5 + 2 for i in range(24)}
+    print_dict = make_print_dict(
+        cards,
+        oversized_enabled=True,
+        oversized={f"card{i}.png": True for i in range(0, 24, 7)},
+    )
+    single = render(print_dict, crop_dir, tmp_path / "single.pdf")
+    chunked = render(print_dict, crop_dir, tmp_path / "chunked.pdf", chunk_pages=2)
+
+    assert chunked.page_count == single.page_count > 4
+    assert len(form_xrefs(chunked)) == len(form_xrefs(single))
+
+
+def page_images(document):
+    names = lambda page: [
+        document.xref_get_key(img[0], pdf.img_name_key)[1] for img in page.get_images()
+    ]
+    return [sorted(names(page)) for page in document]
+
+
+def test_rerender_matches_fresh_render(crop_dir, tmp_path):
+    states = [
+        {"a.png": 3, "b.png": 2, "c.png": 4},
+        {"a.png": 3, "b.png": 5, "d.png": 1},
+        {"c.png": 2, "d.png": 6, "e.png": 2},
+    ]
+    print_dicts = [make_print_dict(cards, backside_enabled=True) for cards in states]
+    fresh = [
+        render(print_dict, crop_dir, tmp_path / f"fresh{i}.pdf")
+        for i, print_dict in enumerate(print_dicts)
+    ]
+
+    # Every render starts from the previous one, nothing may pile up across them
+    for i in range(3 * len(states)):
+        fresh_document = fresh[i % len(states)]
+        document = render(print_dicts[i % len(states)], crop_dir, tmp_path / "out.pdf")
+        assert document.xref_length() == fresh_document.xref_length()
+        assert page_images(document) == page_images(fresh_document)
+        document.close()
+
+
+def test_shared_image_is_embedded_at_its_largest_placement(crop_dir, tmp_path):
+    print_dict = make_print_dict(
+        {"a.png": 9, "b.png": 1},
+        backside_enabled=True,
+        oversized_enabled=True,
+        oversized={"b.png": True},
+        output_profile="Draft",
+    )
+    img_dir = Path(pdf.crop_output_dir(str(crop_dir), 0.0, pdf.CFG.VibranceBump))
+    img_dir.mkdir(parents=True, exist_ok=True)
+    back = pyvips.Image.gaussnoise(2000, 2800).bandjoin([0, 0]).cast("uchar")
+    back.write_to_file(str(img_dir / "__back.png"))
+
+    # The default backside is placed behind the regular cards of the first sheet
+    # before it is placed behind the oversized card on the second sheet
+    document = render(print_dict, crop_dir, tmp_path / "out.pdf")
+    (w, h, _), _, _ = pdf.get_page_layout(print_dict, page_sizes["Letter"])
+    dpi = pdf.output_profiles["Draft"]["dpi"]
+    back_sizes = {
+        img[0]: max(img[2], img[3])
+        for page in document
+        for img in page.get_images()
+        if document.xref_get_key(img[0], pdf.img_name_key)[1] == "__back.png"
+    }
+    assert list(back_sizes.values()) == [round(pdf.point_to_inch(2 * w) * dpi)]
+
+    # A re-render doesn't reuse the image a previous render embedded smaller
+    regular_dict = dict(print_dict, cards={"a.png": 9})
+    render(regular_dict, crop_dir, tmp_path / "rerender.pdf").close()
+    document = render(print_dict, crop_dir, tmp_path / "rerender.pdf")
+    oversized_back = document[-1].get_images()
+    assert [max(img[2], img[3]) for img in oversized_back] == list(back_sizes.values())
@@ -0,0 +1,69 @@
+import os
+import sqlite3
+
+import pytest
+
+import preview_cache
+
+
+def make_entry(seed):
+    return {
+        "data": bytes([seed]) * 300,
+        "size": [248, 346],
+        "thumb": {"data": bytes([seed]) * 100, "size": [112, 156]},
+    }
+
+
+def test_reads_leave_cache_file_untouched(tmp_path):
+    path = str(tmp_path / "img.cache")
+    img_dict = preview_cache.PreviewCache()
+    img_dict.open(path)
+    img_dict.update_entries({f"card{i}.png": make_entry(i) for i in range(5)})
+    img_dict.close()
+
+    stat = os.stat(path)
+    img_dict = preview_cache.PreviewCache()
+    img_dict.open(path)
+    for _ in range(3):
+        for i in range(5):
+            assert img_dict[f"card{i}.png"] == make_entry(i)
+    img_dict.close()
+
+    assert os.stat(path).st_mtime_ns == stat.st_mtime_ns
+    assert os.stat(path).st_size == stat.st_size
+
+
+def test_updates_reach_the_cache_file(tmp_path):
+    path = str(tmp_path / "img.cache")
+    img_dict = preview_cache.PreviewCache()
+    img_dict.open(path)
+    img_dict.update_entries({"a.png": make_entry(1), "b.png": make_entry(2)})
+    img_dict.update_entries({"b.png": make_entry(3)}, ["a.png"])
+
+    reopened = preview_cache.PreviewCache()
+    reopened.open(path)
+    assert dict(reopened) == {"b.png": make_entry(3)}
+    img_dict.close()
+    reopened.close()
+
+
+def test_previews_load_once_per_kind(tmp_path):
+    path = str(tmp_path / "img.cache")
+    img_dict = preview_cache.PreviewCache()
+    img_dict.open(path)
+    img_dict.update_entries({"a.png": make_entry(1)})
+    img_dict.close()
+
+    img_dict.open(path)
+    entry = img_dict["a.png"]
+    assert entry["size"] == [248, 346] and "thumb" in entry
+    assert entry["data"] == make_entry(1)["data"]
+
+    # Loaded previews are kept, other kinds are only read once they're accessed
+    with sqlite3.connect(path) as db:
+        db.execute("DELETE FROM previews")
+    db.close()
+    assert img_dict["a.png"]["data"] == make_entry(1)["data"]
+    with pytest.raises(KeyError):
+        img_dict["a.png"]["thumb"]
+    img_dict.close()
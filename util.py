@@ -1,6 +1,7 @@
 import os
 import sys
 import subprocess
+from collections import OrderedDict
 
 import constants
 
@@ -84,3 +85,48 @@ def resource_path():
 def is_debugger_attached():
     gettrace = getattr(sys, "gettrace", None)
     return gettrace is not None and gettrace() is not None
+
+
+class LRUCache:
+    """Keeps the most recently used values until their summed `sizeof` exceeds `max_size`."""
+
+    def __init__(self, max_size, sizeof=len):
+        self._values = OrderedDict()
+        self._sizes = {}
+        self._size = 0
+        self._sizeof = sizeof
+        self.max_size = max_size
+
+    def __contains__(self, key):
+        return key in self._values
+
+    def __len__(self):
+        return len(self._values)
+
+    def get(self, key, default=None):
+        if key not in self._values:
+            return default
+        self._values.move_to_end(key)
+        return self._values[key]
+
+    def put(self, key, value):
+        self.pop(key)
+        size = self._sizeof(value)
+        self._values[key] = value
+        self._sizes[key] = size
+        self._size += size
+        # Never evict the value that was just added, even if it alone is too large
+        while self._size > self.max_size and len(self._values) > 1:
+            oldest = next(iter(self._values))
+            self.pop(oldest)
+
+    def pop(self, key, default=None):
+        if key not in self._values:
+            return default
+        self._size -= self._sizes.pop(key)
+        return self._values.pop(key)
+
+    def clear(self):
+        self._values.clear()
+        self._sizes.clear()
+        self._size = 0